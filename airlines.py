@@ -0,0 +1,6 @@
+# Twitter user ids of the airline support accounts the analysis is about
+airline_ids = [
+    "56377143", "106062176", "18332190", "22536055", "124476322",
+    "26223583", "2182373406", "38676903", "1542862735", "253340062",
+    "218730857", "45621423", "20626359"
+]
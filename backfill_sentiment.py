@@ -0,0 +1,75 @@
+import os
+import csv
+import argparse
+from ingest_state import load_manifest, save_manifest
+from sentiment_service import SentimentService
+from to_csv import sentiment_columns
+
+OUTPUT_DIR = "import"
+CHUNK_ROWS = 4096  # tweets read, scored and written at a time
+LABEL_COLUMN = 6  # first sentiment column, followed by the expected value and the class probabilities
+
+def backfill(output_dir=OUTPUT_DIR, batch_size=64, client=None):
+    """
+    Score the tweets that were ingested with --no-sentiment: rewrites tweets.csv
+    with the empty sentiment columns filled in. Returns the number of tweets scored.
+    client is an optional sentiment_service client to score with.
+    """
+    if client is not None:
+        get_sentiment_arrays = lambda texts, batch_size: client.get_sentiment_arrays(texts)
+    else:
+        from roberta_sentiment import get_sentiment_arrays
+
+    path = os.path.join(output_dir, "tweets.csv")
+    manifest = load_manifest(output_dir)
+    # The manifest's byte offsets must stay valid for the next --incremental run
+    if manifest is not None and manifest["offsets"].get("tweets.csv") != os.path.getsize(path):
+        raise RuntimeError(f"{path} has rows past the last checkpoint, finish the ingest with --incremental first")
+
+    tmp_path = path + ".tmp"
+    scored = 0
+    with open(path, "r", newline="", encoding="utf-8") as src, \
+         open(tmp_path, "w", newline="", encoding="utf-8") as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        writer.writerow(next(reader))
+
+        def flush(rows):
+            nonlocal scored
+            missing = [row for row in rows if row[LABEL_COLUMN] == ""]
+            if missing:
+                arrays = get_sentiment_arrays([row[2] for row in missing], batch_size)
+                for row, columns in zip(missing, sentiment_columns(arrays)):
+                    row[LABEL_COLUMN:] = columns
+                scored += len(missing)
+            writer.writerows(rows)
+            rows.clear()
+
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= CHUNK_ROWS:
+                flush(rows)
+        flush(rows)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, path)
+
+    if manifest is not None:
+        manifest["offsets"]["tweets.csv"] = os.path.getsize(path)
+        save_manifest(output_dir, manifest)
+    return scored
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill in the sentiment of tweets ingested with to_csv.py --no-sentiment.")
+    parser.add_argument("--input", default=OUTPUT_DIR, help="directory with tweets.csv")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--sentiment-replicas", type=int, default=0,
+                        help="score in a pool of this many model processes (0: in process)")
+    args = parser.parse_args()
+    if args.sentiment_replicas:
+        with SentimentService(args.sentiment_replicas, max_clients=1) as service:
+            scored = backfill(args.input, args.batch_size, service.client())
+    else:
+        scored = backfill(args.input, args.batch_size)
+    print(f"Scored {scored} tweets")
@@ -0,0 +1,5 @@
+"""
+Reproducible ingestion benchmarks: a seeded tweet corpus generator, a stub
+sentiment backend with tunable latency and a harness that runs to_csv.py over
+a grid of settings. See benchmark/run.py.
+"""
@@ -0,0 +1,143 @@
+import os
+import gzip
+import json
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+from airlines import airline_ids
+
+TWITTER_TS_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+WORDS = ("flight delayed again gate crew seat bag lost luggage refund ticket thanks great awful "
+         "service help please waiting hours cancelled boarding plane airport staff friendly rude "
+         "upgrade miles customer support terrible amazing late early connection missed").split()
+OTHER_LANGS = ["nl", "de", "es", "fr", "it", "und", "ja"]
+
+# Share of each line type, the rest are plain original tweets
+DEFAULT_MIX = {
+    "delete": 0.10,
+    "foreign": 0.25,
+    "retweet": 0.20,
+    "quote": 0.05,
+    "reply": 0.25,
+}
+
+class CorpusGenerator:
+    """
+    Seeded generator of raw Twitter API lines shaped like the real dumps:
+    deletes, non-English tweets, retweets, quotes, extended tweets and reply
+    chains in which the airline accounts take part. Same seed, same corpus.
+    """
+    def __init__(self, seed=0, n_users=5000, mix=None, airline_share=0.3,
+                 start=datetime(2019, 5, 22, tzinfo=timezone.utc)):
+        self.rng = random.Random(seed)
+        self.mix = dict(DEFAULT_MIX, **(mix or {}))
+        self.airline_share = airline_share
+        self.users = [self._user(str(10_000_000 + i)) for i in range(n_users)]
+        self.airlines = [self._user(uid, verified=True) for uid in airline_ids]
+        self.next_id = 1_130_000_000_000_000_000
+        self.now = start
+        self.recent = []  # recent English tweets, candidates for replies, retweets and quotes
+
+    def _user(self, uid, verified=False):
+        return {
+            "id_str": uid,
+            "name": "User " + uid,
+            "screen_name": "user" + uid,
+            "followers_count": self.rng.randint(0, 50_000),
+            "verified": verified,
+        }
+
+    def _text(self, mention=None):
+        words = self.rng.choices(WORDS, k=self.rng.randint(4, 45))
+        if mention:
+            words.insert(0, "@" + mention)
+        if self.rng.random() < 0.2:
+            words.append("https://t.co/" + "".join(self.rng.choices("abcdefghijk", k=10)))
+        return " ".join(words)
+
+    def _tweet(self, user, lang="en", text=None):
+        self.next_id += self.rng.randint(1, 1000)
+        self.now += timedelta(milliseconds=self.rng.randint(1, 500))
+        text = text or self._text()
+        tweet = {
+            "created_at": self.now.strftime(TWITTER_TS_FORMAT),
+            "id": self.next_id,
+            "id_str": str(self.next_id),
+            "text": text[:140],
+            "user": user,
+            "lang": lang,
+            "is_quote_status": False,
+            "entities": {"hashtags": [], "urls": [], "user_mentions": []},
+            "timestamp_ms": str(int(self.now.timestamp() * 1000)),
+        }
+        if len(text) > 140:
+            tweet["truncated"] = True
+            tweet["extended_tweet"] = {"full_text": text}
+        return tweet
+
+    def _remember(self, tweet):
+        self.recent.append(tweet)
+        if len(self.recent) > 2000:
+            del self.recent[:1000]
+
+    def line(self):
+        kind = self.rng.choices(list(self.mix) + ["original"], weights=list(self.mix.values()) + [1 - sum(self.mix.values())])[0]
+        user = self.rng.choice(self.users)
+
+        if kind == "delete":
+            tid = self.rng.randint(10 ** 17, 10 ** 18)
+            return {"delete": {"status": {"id": tid, "id_str": str(tid), "user_id": int(user["id_str"]),
+                                          "user_id_str": user["id_str"]}, "timestamp_ms": "1558519200000"}}
+        if kind == "foreign":
+            return self._tweet(user, lang=self.rng.choice(OTHER_LANGS))
+        if not self.recent or kind == "original":
+            tweet = self._tweet(user)
+        elif kind == "retweet":
+            original = self.rng.choice(self.recent)
+            tweet = self._tweet(user, text="RT @" + original["user"]["screen_name"] + ": " + original["text"])
+            tweet["retweeted_status"] = original
+        elif kind == "quote":
+            original = self.rng.choice(self.recent)
+            tweet = self._tweet(user)
+            tweet["is_quote_status"] = True
+            tweet["quoted_status"] = original
+        else:
+            # Replies cluster on the most recent tweets, so reply trees grow several levels deep
+            parent = self.rng.choice(self.recent[-50:])
+            if self.rng.random() < self.airline_share:
+                user = self.rng.choice(self.airlines)
+            tweet = self._tweet(user, text=self._text(mention=parent["user"]["screen_name"]))
+            tweet["in_reply_to_status_id"] = parent["id"]
+            tweet["in_reply_to_status_id_str"] = parent["id_str"]
+            tweet["in_reply_to_user_id"] = int(parent["user"]["id_str"])
+            tweet["in_reply_to_user_id_str"] = parent["user"]["id_str"]
+        self._remember(tweet)
+        return tweet
+
+def write_corpus(data_dir, n_files=4, lines_per_file=50_000, seed=0, compress=False, **kwargs):
+    """
+    Write n_files dumps of lines_per_file lines each into data_dir. Returns the paths.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    generator = CorpusGenerator(seed=seed, **kwargs)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(data_dir, f"tweets_{i:03d}.json" + (".gz" if compress else ""))
+        opener = gzip.open if compress else open
+        with opener(path, "wt", encoding="utf-8") as f:
+            for _ in range(lines_per_file):
+                f.write(json.dumps(generator.line(), separators=(",", ":")) + "\n")
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw tweet corpus.")
+    parser.add_argument("--output", default="data")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=50_000, help="lines per file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+    for path in write_corpus(args.output, args.files, args.lines, args.seed, args.gzip):
+        print(path)
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import itertools
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmark.generate import write_corpus
+
+METRICS_FILE = "metrics.jsonl"
+# Stage timers reported per run, as named in ingest_metrics snapshots
+STAGES = ["parse", "inference", "write", "merge", "producer_blocked", "inference_blocked"]
+
+def child_main(argv):
+    """
+    Runs inside the benchmark child process: swap the model for the stub and run to_csv.main().
+    """
+    from benchmark import stub_sentiment
+    sys.modules["roberta_sentiment"] = stub_sentiment
+    import to_csv
+    sys.argv = ["to_csv.py"] + argv
+    to_csv.main()
+
+def run_once(work_dir, mode, workers, batch_size, extra_args=()):
+    """
+    Run one ingest in work_dir (which holds data/) and return its result row.
+    Peak RSS comes from wait4, so it covers this run only (the main process, not process-mode workers).
+    """
+    shutil.rmtree(os.path.join(work_dir, "import"), ignore_errors=True)
+    metrics_path = os.path.join(work_dir, METRICS_FILE)
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", "--mode", mode, "--workers", str(workers),
+           "--batch-size", str(batch_size), "--metrics", METRICS_FILE, "--metrics-interval", "3600", *extra_args]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark run failed: {' '.join(cmd)}")
+
+    with open(metrics_path, "r", encoding="utf-8") as f:
+        snap = [json.loads(line) for line in f][-1]
+    lines = snap["counters"].get("lines_read", 0)
+    return {
+        "mode": mode,
+        "workers": workers,
+        "batch_size": batch_size,
+        "seconds": round(wall, 3),
+        "lines": lines,
+        "lines_per_s": round(lines / wall, 1),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "stages": {stage: snap["seconds"].get(stage, 0.0) for stage in STAGES},
+    }
+
+def print_table(results):
+    header = f"{'mode':<10}{'workers':>8}{'batch':>7}{'lines/s':>12}{'rss MB':>9}" + "".join(f"{s:>18}" for s in STAGES)
+    print(header)
+    for r in results:
+        print(f"{r['mode']:<10}{r['workers']:>8}{r['batch_size']:>7}{r['lines_per_s']:>12,.0f}{r['peak_rss_mb']:>9.1f}"
+              + "".join(f"{r['stages'][s]:>17.2f}s" for s in STAGES))
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the runs whose throughput dropped more than tolerance below the matching baseline run.
+    """
+    key = lambda r: (r["mode"], r["workers"], r["batch_size"])
+    previous = {key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get(key(r))
+        if old and r["lines_per_s"] < old["lines_per_s"] * (1 - tolerance):
+            regressions.append((r, old))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark to_csv.py on a synthetic corpus with a stub sentiment model.")
+    parser.add_argument("--modes", nargs="+", default=["threads"], choices=["threads", "processes"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 6], help="producer threads or worker processes")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=20_000, help="lines per generated file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gzip", action="store_true", help="generate gzipped input files")
+    parser.add_argument("--batch-ms", type=float, default=None, help="stub latency per inference call")
+    parser.add_argument("--text-ms", type=float, default=None, help="stub latency per text")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per setting, the fastest is kept")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--baseline", default=None, help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed throughput drop against --baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    args, extra = parser.parse_known_args()
+
+    if args.batch_ms is not None:
+        os.environ["BENCH_SENTIMENT_BATCH_MS"] = str(args.batch_ms)
+    if args.text_ms is not None:
+        os.environ["BENCH_SENTIMENT_TEXT_MS"] = str(args.text_ms)
+
+    work_dir = tempfile.mkdtemp(prefix="to_csv_bench_")
+    try:
+        write_corpus(os.path.join(work_dir, "data"), args.files, args.lines, args.seed, args.gzip)
+        results = []
+        for mode, workers, batch_size in itertools.product(args.modes, args.workers, args.batch_sizes):
+            runs = [run_once(work_dir, mode, workers, batch_size, extra) for _ in range(args.repeat)]
+            results.append(max(runs, key=lambda r: r["lines_per_s"]))
+            print(f"{mode} workers={workers} batch={batch_size}: {results[-1]['lines_per_s']:,.0f} lines/s", file=sys.stderr)
+    finally:
+        if args.keep:
+            print(f"Working directory kept at {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r, old in regressions:
+            print(f"REGRESSION {r['mode']} workers={r['workers']} batch={r['batch_size']}: "
+                  f"{r['lines_per_s']:,.0f} lines/s vs {old['lines_per_s']:,.0f} in the baseline")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child_main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each case runs in a fresh interpreter, so module caches and loaded models don't carry over
+CASES = {
+    "import_roberta_sentiment": "import roberta_sentiment",
+    "import_to_csv": "import to_csv",
+    "import_roberta_on_conv": "import roberta_on_conv",
+    "first_sentiment": "import roberta_sentiment; roberta_sentiment.get_sentiment('startup benchmark')",
+}
+
+def time_case(code, repeat):
+    # The cache is off, so first_sentiment always pays for loading the model
+    env = dict(os.environ, SENTIMENT_CACHE="", PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {"min": round(min(timings), 3), "median": round(statistics.median(timings), 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the sentiment modules.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--baseline", default=None, help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against --baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.cases:
+        results[name] = time_case(CASES[name], args.repeat)
+        print(f"{name:<28} min {results[name]['min']:>8.3f}s  median {results[name]['median']:>8.3f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = [name for name, r in results.items()
+                       if name in baseline and r["min"] > baseline[name]["min"] * (1 + args.tolerance)]
+        for name in regressions:
+            print(f"REGRESSION {name}: {results[name]['min']:.3f}s vs {baseline[name]['min']:.3f}s in the baseline")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
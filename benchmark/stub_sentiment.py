@@ -0,0 +1,48 @@
+import os
+import time
+import zlib
+import numpy as np
+
+# Simulated model latency, per call and per text, in milliseconds
+BATCH_LATENCY_MS = float(os.environ.get("BENCH_SENTIMENT_BATCH_MS", "5"))
+TEXT_LATENCY_MS = float(os.environ.get("BENCH_SENTIMENT_TEXT_MS", "0.5"))
+
+LABELS = ["negative", "neutral", "positive"]
+
+def _probs(text):
+    # Deterministic per text, so runs can be diffed
+    h = zlib.crc32(text.encode("utf-8"))
+    weights = np.array([h & 0xff, (h >> 8) & 0xff, (h >> 16) & 0xff], dtype=np.float64) + 1
+    return weights / weights.sum()
+
+def _score(text):
+    probs = _probs(text)
+    return LABELS[int(probs.argmax())], round(float(probs[2] - probs[0]), 4)
+
+def warm_up(num_threads=None):
+    """
+    Same hook as roberta_sentiment.warm_up, there is no model to load.
+    """
+
+def get_sentiment(text):
+    time.sleep((BATCH_LATENCY_MS + TEXT_LATENCY_MS) / 1000)
+    return _score(text)
+
+def get_sentiment_arrays(texts, batch_size=64):
+    """
+    Same columns as roberta_sentiment.get_sentiment_arrays.
+    """
+    time.sleep((BATCH_LATENCY_MS + TEXT_LATENCY_MS * len(texts)) / 1000)
+    probs = np.array([_probs(text) for text in texts]).reshape(-1, 3)
+    arrays = {label: probs[:, i] for i, label in enumerate(LABELS)}
+    arrays["label"] = np.array(LABELS)[probs.argmax(axis=1)]
+    arrays["expected_value"] = np.round(probs[:, 2] - probs[:, 0], 4)
+    return arrays
+
+def get_sentiment_batch(texts, batch_size=64):
+    """
+    Same interface as roberta_sentiment.get_sentiment_batch, with sleep standing in for the model.
+    time.sleep releases the GIL like a torch forward pass does.
+    """
+    time.sleep((BATCH_LATENCY_MS + TEXT_LATENCY_MS * len(texts)) / 1000)
+    return [_score(text) for text in texts]
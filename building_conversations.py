@@ -1,26 +1,26 @@
 import os
 import csv
+import argparse
 import time
 import logging
 from collections import defaultdict
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from multiprocessing import Process, Manager
-from neo4j import GraphDatabase
-from neo4j.exceptions import TransientError
+from airlines import airline_ids
+from conversation_order import order_component, tweet_time
+from parquet_output import close_sinks, open_sinks
 
 # Config
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "password"
 DB_NAME = "twitter"
+GRAPH_NAME = "Graph_replies"  # the one GDS projection of the build
+FETCH_BATCH = 50000  # tweets per reply tree query
 MAX_WORKERS = 6
 LOG_EVERY_N = 100
-
-airline_ids = [
-    "56377143", "106062176", "18332190", "22536055", "124476322",
-    "26223583", "2182373406", "38676903", "1542862735", "253340062",
-    "218730857", "45621423", "20626359"
-]
+CONVERSATIONS_HEADER = [":LABEL", ":ID(Conversation)", "airlineId", "start", "end"]
+CONVERSATION_EDGES_HEADER = [":START_ID(Conversation)", ":END_ID(Tweet)", ":TYPE", "positionType:int"]
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,6 +28,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Reply components, children and created_at of the build, set in every worker by init_worker
+_components = []
+_children = {}
+_created_at = {}
+_chronological = False
+
 def annotate_positions(conversation, airline_tweet_ids):
     annotations = {}
     airline_indices = [i for i, tid in enumerate(conversation) if tid in airline_tweet_ids]
@@ -45,114 +51,150 @@ def annotate_positions(conversation, airline_tweet_ids):
             annotations[tid] = 0
     return annotations
 
-def get_conversations(airline_id, queue):
-    try:
-        logger.info(f"START: Processing airline {airline_id}")
-        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        graph_name = f"Graph_{airline_id}"
-
-        with driver.session(database=DB_NAME) as session:
-            try:
-                session.run("CREATE INDEX tweet_id_index IF NOT EXISTS FOR (t:Tweet) ON (t.tweetId)")
-                session.run("CREATE INDEX user_id_index IF NOT EXISTS FOR (u:User) ON (u.userId)")
-            except Exception as e:
-                logger.warning(f"Index creation issue: {e}")
-
-            try:
-                session.run(f"CALL gds.graph.drop('{graph_name}')")
-            except Exception:
-                pass
-
-            session.run(f"""
-            CALL gds.graph.project(
-                '{graph_name}', 'Tweet', {{
-                    REPLIES: {{type: 'REPLIES', orientation: 'UNDIRECTED'}}
-                }}
-            )
-            """)
-
-            session.run(f"""
-            CALL gds.wcc.write('{graph_name}', {{
-                writeProperty: 'componentId'
-            }})
-            """)
+def trim_conversation(ordered, airline_tweet_ids, min_size=3):
+    """
+    Cut the airline's tweets off both ends of an ordered component. Returns the rest if it
+    still has an airline tweet inside and at least min_size tweets, otherwise None.
+    """
+    start, end = 0, len(ordered)
+    while start < end and ordered[start] in airline_tweet_ids:
+        start += 1
+    while end > start and ordered[end - 1] in airline_tweet_ids:
+        end -= 1
+
+    trimmed = ordered[start:end]
+    has_airline_inside = any(tid in airline_tweet_ids for tid in trimmed)
+    if has_airline_inside and len(trimmed) >= min_size:
+        return trimmed
+    return None
+
+def shared_components(airline_ids):
+    """
+    Weakly connected components of the whole REPLIES graph, computed once per build
+    from a single projection. Returns (components, airline_tweets): the tweet lists of the
+    components that can yield a conversation, and every airline's tweet ids with the
+    indices of the components that contain them.
+    """
+    # Imported here, so offline_conversations.py can use this module without the driver installed
+    from neo4j import GraphDatabase
+    logger.info("START: Computing reply components")
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+
+    with driver.session(database=DB_NAME) as session:
+        try:
+            session.run("CREATE INDEX tweet_id_index IF NOT EXISTS FOR (t:Tweet) ON (t.tweetId)")
+            session.run("CREATE INDEX user_id_index IF NOT EXISTS FOR (u:User) ON (u.userId)")
+        except Exception as e:
+            logger.warning(f"Index creation issue: {e}")
 
+        try:
+            session.run(f"CALL gds.graph.drop('{GRAPH_NAME}')")
+        except Exception:
+            pass
+
+        session.run(f"""
+        CALL gds.graph.project(
+            '{GRAPH_NAME}', 'Tweet', {{
+                REPLIES: {{type: 'REPLIES', orientation: 'UNDIRECTED'}}
+            }}
+        )
+        """)
+
+        # Streamed instead of written back, so the workers never write to the database
+        wcc_result = session.run(f"""
+        CALL gds.wcc.stream('{GRAPH_NAME}')
+        YIELD nodeId, componentId
+        RETURN gds.util.asNode(nodeId).tweetId AS tweetId, componentId
+        """)
+
+        by_id = defaultdict(list)
+        for record in wcc_result:
+            by_id[record["componentId"]].append(record["tweetId"])
+
+        session.run(f"CALL gds.graph.drop('{GRAPH_NAME}', false)")
+
+        result = session.run("""
+        MATCH (u:User)-[:POSTED]->(t:Tweet)
+        WHERE u.userId IN $airline_ids
+        RETURN u.userId AS userId, collect(t.tweetId) AS tweetIds
+        """, airline_ids=list(airline_ids))
+        posted = {record["userId"]: set(str(tid) for tid in record["tweetIds"]) for record in result}
+    driver.close()
+
+    # Fewer than 3 tweets can't leave an airline tweet with another tweet on either side
+    components = [tweet_list for tweet_list in by_id.values() if len(tweet_list) >= 3]
+    del by_id
+    component_of = {tid: i for i, tweet_list in enumerate(components) for tid in tweet_list}
+
+    airline_tweets = {}
+    for airline_id in airline_ids:
+        airline_tweet_ids = posted.get(airline_id, set())
+        component_ids = sorted({component_of[tid] for tid in airline_tweet_ids if tid in component_of})
+        airline_tweets[airline_id] = (airline_tweet_ids, component_ids)
+
+    logger.info(f"END: {len(components)} reply components of 3 or more tweets")
+    return components, airline_tweets
+
+def fetch_reply_trees(tweet_ids, batch_size=FETCH_BATCH):
+    """
+    Children and created_at of the given tweets, read batch_size tweets per query,
+    so the number of round trips doesn't grow with the number of components.
+    """
+    from neo4j import GraphDatabase
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    children, created_at = {}, {}
+
+    with driver.session(database=DB_NAME) as session:
+        for i in range(0, len(tweet_ids), batch_size):
             result = session.run("""
-            MATCH (u:User {userId: $airline_id})-[:POSTED]->(t:Tweet)
-            RETURN t.tweetId AS tweetId
-            """, airline_id=airline_id)
-            airline_tweet_ids = set(str(record["tweetId"]) for record in result)
-
-            wcc_result = session.run("""
-            MATCH (t:Tweet)
-            WHERE t.componentId IS NOT NULL
-            RETURN t.tweetId AS tweetId, t.componentId AS componentId
-            """)
-
-            components = defaultdict(list)
-            for record in wcc_result:
-                components[record["componentId"]].append(record["tweetId"])
-
-            for tweet_list in components.values():
-                if len(tweet_list) < 2:
-                    continue
-
-                reply_tree_result = session.run("""
-                UNWIND $tweet_ids AS tid
-                MATCH (t:Tweet {tweetId: tid})
-                OPTIONAL MATCH (t)<-[:REPLIES]-(child:Tweet)
-                WITH t.tweetId AS parent, collect(DISTINCT child.tweetId) AS children
-                RETURN parent, children
-                """, tweet_ids=tweet_list)
-
-                children_map = {record["parent"]: record["children"] for record in reply_tree_result}
-                all_children = {c for clist in children_map.values() for c in clist}
-
-                def dfs(node, visited, result):
-                    if node in visited:
-                        return
-                    visited.add(node)
-                    for child in children_map.get(node, []):
-                        dfs(child, visited, result)
-                    result.append(node)
-
-                visited, ordered = set(), []
-                for root in set(tweet_list) - all_children:
-                    dfs(root, visited, ordered)
-
-                ordered = list(reversed(ordered))
-
-                start, end = 0, len(ordered)
-                while start < end and ordered[start] in airline_tweet_ids:
-                    start += 1
-                while end > start and ordered[end - 1] in airline_tweet_ids:
-                    end -= 1
-
-                trimmed = ordered[start:end]
-                has_airline_inside = any(tid in airline_tweet_ids for tid in trimmed)
-
-                if has_airline_inside and len(trimmed) >= 3:
-                    annotations = annotate_positions(trimmed, airline_tweet_ids)
-
-                    time_result = session.run("""
-                    MATCH (t:Tweet)
-                    WHERE t.tweetId IN [$start_tid, $end_tid]
-                    RETURN t.tweetId AS tweetId, t.created_at AS created_at
-                    """, start_tid=trimmed[0], end_tid=trimmed[-1])
-                    time_map = {r["tweetId"]: r["created_at"] for r in time_result}
-                    start_time = time_map.get(trimmed[0])
-                    end_time = time_map.get(trimmed[-1])
-
-                    logger.info(f"Airline {airline_id}: putting conversation of size {len(trimmed)} into queue")
-                    queue.put((airline_id, trimmed, annotations, start_time, end_time))
-
-            session.run(f"CALL gds.graph.drop('{graph_name}', false)")
-            logger.info(f"END: Finished airline {airline_id}")
-
-    except Exception as e:
-        logger.error(f"FATAL ERROR in airline {airline_id}: {e}")
+            UNWIND $tweet_ids AS tid
+            MATCH (t:Tweet {tweetId: tid})
+            OPTIONAL MATCH (t)<-[:REPLIES]-(child:Tweet)
+            WITH t, collect(DISTINCT child.tweetId) AS children
+            RETURN t.tweetId AS parent, t.created_at AS created_at, children
+            """, tweet_ids=tweet_ids[i:i + batch_size])
+            for record in result:
+                created_at[record["parent"]] = record["created_at"]
+                if record["children"]:
+                    children[record["parent"]] = record["children"]
+    driver.close()
+
+    logger.info(f"Fetched the reply trees of {len(tweet_ids)} tweets")
+    return children, created_at
+
+def init_worker(shared_components, shared_children, shared_created_at, chronological):
+    # Every worker gets the reply trees once, instead of with every airline
+    global _components, _children, _created_at, _chronological
+    _components = shared_components
+    _children = shared_children
+    _created_at = shared_created_at
+    _chronological = chronological
+
+def get_conversations(airline_id, airline_tweet_ids, component_ids, queue):
+    logger.info(f"START: Processing airline {airline_id}, {len(component_ids)} components")
+    key = (lambda tid: tweet_time(_created_at.get(tid))) if _chronological else None
+    for component_id in component_ids:
+        tweet_list = _components[component_id]
+        # Made of this airline's tweets only, trimming would leave nothing
+        if all(tid in airline_tweet_ids for tid in tweet_list):
+            continue
+
+        children_map = {tid: _children[tid] for tid in tweet_list if tid in _children}
+        ordered = order_component(tweet_list, children_map, key)
+        trimmed = trim_conversation(ordered, airline_tweet_ids)
+
+        if trimmed is not None:
+            annotations = annotate_positions(trimmed, airline_tweet_ids)
+            start_time = _created_at.get(trimmed[0])
+            end_time = _created_at.get(trimmed[-1])
+
+            logger.info(f"Airline {airline_id}: putting conversation of size {len(trimmed)} into queue")
+            queue.put((airline_id, trimmed, annotations, start_time, end_time))
+
+    logger.info(f"END: Finished airline {airline_id}")
 
 def retry_on_deadlock(func, max_retries=3, delay=2):
+    from neo4j.exceptions import TransientError
     for attempt in range(max_retries):
         try:
             return func()
@@ -164,11 +206,7 @@ def retry_on_deadlock(func, max_retries=3, delay=2):
             raise
     raise RuntimeError("Max retries exceeded due to deadlocks.")
 
-def get_conversations_with_retry(airline_id, queue):
-    return retry_on_deadlock(lambda: get_conversations(airline_id, queue))
-
-def csv_writer(queue):
-    output_dir = "import"
+def csv_writer(queue, parquet=False, output_dir="import"):
     os.makedirs(output_dir, exist_ok=True)
 
     conv_csv_path = os.path.join(output_dir, "conversations.csv")
@@ -182,8 +220,11 @@ def csv_writer(queue):
         conv_writer = csv.writer(conv_file)
         edge_writer = csv.writer(edge_file)
 
-        conv_writer.writerow([":LABEL", ":ID(Conversation)", "airlineId", "start", "end"])
-        edge_writer.writerow([":START_ID(Conversation)", ":END_ID(Tweet)", ":TYPE", "positionType:int"])
+        conv_writer.writerow(CONVERSATIONS_HEADER)
+        edge_writer.writerow(CONVERSATION_EDGES_HEADER)
+
+        # Optional columnar copy of both files for the downstream stages
+        sinks = open_sinks(["conversations", "conversation_edges"], root=os.path.join(output_dir, "parquet")) if parquet else None
 
         conv_id = 1
         while True:
@@ -198,10 +239,14 @@ def csv_writer(queue):
 
             airline_id, tweet_ids, annotations, start_time, end_time = data
             conv_writer.writerow(["Conversation", f"c{conv_id}", airline_id, start_time, end_time])
+            if sinks:
+                sinks["conversations"].write((f"c{conv_id}", airline_id, start_time, end_time))
 
             for tid in tweet_ids:
                 part_type = annotations.get(tid, 0)
                 edge_writer.writerow(["c" + str(conv_id), tid, "PART_OF", part_type])
+                if sinks:
+                    sinks["conversation_edges"].write((f"c{conv_id}", tid, part_type))
 
             conv_count += 1
             if conv_count % LOG_EVERY_N == 0:
@@ -209,11 +254,20 @@ def csv_writer(queue):
 
             conv_id += 1
 
-def parallel_extract(airline_ids, queue):
+        if sinks:
+            close_sinks(sinks)
+
+def parallel_extract(airline_ids, queue, chronological=False):
+    components, airline_tweets = retry_on_deadlock(lambda: shared_components(airline_ids))
+    needed = sorted({cid for _, component_ids in airline_tweets.values() for cid in component_ids})
+    children, created_at = fetch_reply_trees([tid for cid in needed for tid in components[cid]])
+
+    # The workers only order and trim, all database reads are done by now
     logger.info(f"Launching {MAX_WORKERS} workers for {len(airline_ids)} airlines.")
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=init_worker,
+                             initargs=(components, children, created_at, chronological)) as executor:
         futures = {
-            executor.submit(get_conversations_with_retry, aid, queue): aid
+            executor.submit(get_conversations, aid, *airline_tweets[aid], queue): aid
             for aid in airline_ids
         }
         for future in as_completed(futures):
@@ -226,13 +280,20 @@ def parallel_extract(airline_ids, queue):
     queue.put("DONE")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build airline conversations from the reply graph in Neo4j.")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also write conversations and conversation_edges as Parquet datasets (needs pyarrow)")
+    parser.add_argument("--chronological", action="store_true",
+                        help="order every reply tree by created_at instead of the reply graph's own order")
+    args = parser.parse_args()
+
     with Manager() as manager:
         queue = manager.Queue()
 
-        writer_process = Process(target=csv_writer, args=(queue,))
+        writer_process = Process(target=csv_writer, args=(queue, args.parquet))
         writer_process.start()
 
-        parallel_extract(airline_ids, queue)
+        parallel_extract(airline_ids, queue, args.chronological)
 
         writer_process.join(timeout=600)
         if writer_process.is_alive():
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+TWITTER_TS_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+MISSING_TIME = datetime.min.replace(tzinfo=timezone.utc)  # tweets without a created_at sort first
+
+def tweet_time(created_at):
+    """
+    Parse a created_at as written to tweets.csv, for use as an ordering key.
+    """
+    if not created_at:
+        return MISSING_TIME
+    return datetime.strptime(created_at, TWITTER_TS_FORMAT)
+
+def build_adjacency(tweet_list, children_map, key=None):
+    """
+    Compact (CSR) adjacency of a reply component: the children of node i are
+    targets[offsets[i]:offsets[i + 1]]. Returns (nodes, offsets, targets), nodes[i]
+    being the tweet id of node i. Children missing from tweet_list are appended to nodes.
+    With key, children are stored latest first.
+    """
+    nodes = list(tweet_list)
+    index = {tid: i for i, tid in enumerate(nodes)}
+    offsets, targets = [0], []
+
+    i = 0
+    while i < len(nodes):
+        children = children_map.get(nodes[i], ())
+        if key is not None:
+            children = sorted(children, key=key, reverse=True)
+        for child in children:
+            j = index.get(child)
+            if j is None:
+                j = index[child] = len(nodes)
+                nodes.append(child)
+            targets.append(j)
+        offsets.append(len(targets))
+        i += 1
+    return nodes, offsets, targets
+
+def order_component(tweet_list, children_map, key=None):
+    """
+    Order a reply component: reversed DFS post-order from every root (tweet that
+    replies to nothing in the component), so parents come before their replies.
+
+    Roots and children are visited in the order tweet_list and children_map give them.
+    With key (e.g. the tweet's created_at through tweet_time), the earliest root
+    and the earliest reply of every tweet come first instead.
+
+    The traversal is iterative and linear in the size of the component, so deep
+    reply chains don't run into the recursion limit.
+    """
+    nodes, offsets, targets = build_adjacency(tweet_list, children_map, key)
+    n = len(nodes)
+
+    all_children = {c for clist in children_map.values() for c in clist}
+    roots = [i for i, tid in enumerate(tweet_list) if tid not in all_children]
+    if key is not None:
+        roots.sort(key=lambda i: key(nodes[i]), reverse=True)
+
+    visited = bytearray(n)
+    next_edge = offsets[:-1]
+    post_order = []
+    for root in roots:
+        if visited[root]:
+            continue
+        visited[root] = 1
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            edge = next_edge[node]
+            if edge < offsets[node + 1]:
+                next_edge[node] = edge + 1
+                child = targets[edge]
+                if not visited[child]:
+                    visited[child] = 1
+                    stack.append(child)
+            else:
+                stack.pop()
+                post_order.append(node)
+
+    return [nodes[i] for i in reversed(post_order)]
@@ -0,0 +1,233 @@
+import io
+import os
+import csv
+import json
+import sqlite3
+import pandas as pd
+from ingest_state import load_manifest
+
+STATE_DIRNAME = ".conversation_state"
+STATE_NAME = "state.sqlite"
+INPUT_FILES = ["tweets.csv", "posted.csv", "replies.csv"]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS tweets (tweet_id TEXT PRIMARY KEY, created_at TEXT) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS airline_tweets (tweet_id TEXT PRIMARY KEY, airline_id TEXT) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS components (tweet_id TEXT PRIMARY KEY, component INTEGER) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS components_component ON components (component);
+    -- seq keeps the order of replies.csv, the UNIQUE index also serves the lookups by child
+    CREATE TABLE IF NOT EXISTS replies (seq INTEGER PRIMARY KEY, child TEXT, parent TEXT, UNIQUE (child, parent));
+    CREATE TABLE IF NOT EXISTS conversations (
+        conv_id INTEGER PRIMARY KEY, airline_id TEXT, component INTEGER, start TEXT, end TEXT
+    );
+    CREATE INDEX IF NOT EXISTS conversations_component ON conversations (component);
+    CREATE TABLE IF NOT EXISTS conversation_edges (
+        conv_id INTEGER, position INTEGER, tweet_id TEXT, position_type INTEGER,
+        PRIMARY KEY (conv_id, position)
+    ) WITHOUT ROWID;
+    -- The ids a lookup is for, CROSS JOIN makes SQLite drive the join from them
+    CREATE TEMP TABLE IF NOT EXISTS keys (key PRIMARY KEY);
+"""
+
+def state_path(output_dir):
+    return os.path.join(output_dir, STATE_DIRNAME, STATE_NAME)
+
+class ConversationState:
+    """
+    What --delta continues from, in SQLite keyed by tweet, component and conversation id,
+    so a run only reads the rows of the components it touches: the created_at of every
+    tweet, the airline tweets, the reply edges, the reply component of every tweet in a
+    reply and the current conversations with their edges. meta holds the input offsets
+    of the last run and the next free ids. Nothing is visible before commit().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def _fill_keys(self, keys):
+        self.conn.execute("DELETE FROM temp.keys")
+        self.conn.executemany("INSERT OR IGNORE INTO temp.keys VALUES (?)", ((key,) for key in keys))
+
+    def load_meta(self):
+        return {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")}
+
+    def save_meta(self, meta):
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              [(key, json.dumps(value)) for key, value in meta.items()])
+
+    def put_tweets(self, tweet_ids, created_at):
+        self.conn.executemany("INSERT OR REPLACE INTO tweets VALUES (?, ?)", zip(tweet_ids, created_at))
+
+    def put_airline_tweets(self, tweet_ids, airline_ids):
+        self.conn.executemany("INSERT OR REPLACE INTO airline_tweets VALUES (?, ?)", zip(tweet_ids, airline_ids))
+
+    def add_replies(self, children, parents):
+        # Parallel duplicates are dropped, the same as load_replies does
+        self.conn.executemany("INSERT OR IGNORE INTO replies (child, parent) VALUES (?, ?)", zip(children, parents))
+
+    def put_components(self, tweet_ids, components):
+        self.conn.executemany("INSERT OR REPLACE INTO components VALUES (?, ?)",
+                              zip(tweet_ids, (int(component) for component in components)))
+
+    def components_of(self, tweet_ids):
+        """
+        tweet id -> component id, for the tweets that are in a reply.
+        """
+        self._fill_keys(tweet_ids)
+        rows = self.conn.execute(
+            "SELECT tweet_id, component FROM temp.keys CROSS JOIN components ON tweet_id = key").fetchall()
+        return pd.Series(dict(rows), dtype="int64")
+
+    def members(self, components):
+        self._fill_keys(int(component) for component in components)
+        return [row[0] for row in self.conn.execute(
+            "SELECT tweet_id FROM temp.keys CROSS JOIN components ON component = key")]
+
+    def replies_of(self, children):
+        """
+        The reply edges from the given tweets, in replies.csv order, as a start/end DataFrame.
+        """
+        self._fill_keys(children)
+        rows = self.conn.execute(
+            "SELECT child, parent FROM temp.keys CROSS JOIN replies ON child = key ORDER BY seq").fetchall()
+        return pd.DataFrame(rows, columns=["start", "end"], dtype=str)
+
+    def created_at(self, tweet_ids):
+        self._fill_keys(tweet_ids)
+        rows = self.conn.execute(
+            "SELECT tweet_id, created_at FROM temp.keys CROSS JOIN tweets ON tweet_id = key").fetchall()
+        return pd.Series(dict(rows), dtype=str)
+
+    def airline_tweets(self, tweet_ids):
+        """
+        The airline tweets among tweet_ids, as a start (airline id) / end (tweet id) DataFrame like posted.csv.
+        """
+        self._fill_keys(tweet_ids)
+        rows = self.conn.execute(
+            "SELECT airline_id, tweet_id FROM temp.keys CROSS JOIN airline_tweets ON tweet_id = key").fetchall()
+        return pd.DataFrame(rows, columns=["start", "end"], dtype=str)
+
+    def conversations_in(self, components):
+        """
+        (conv_id, airline_id, component) of the conversations in the given components.
+        """
+        self._fill_keys(int(component) for component in components)
+        return self.conn.execute("SELECT conv_id, airline_id, component "
+                                 "FROM temp.keys CROSS JOIN conversations ON component = key").fetchall()
+
+    def conversation_rows(self, conv_ids):
+        """
+        The conversations.csv row and conversation_edges.csv rows of every conversation id,
+        as strings the way they read back from the CSVs: {conv_id: (row, edge rows)}.
+        """
+        self._fill_keys(conv_ids)
+        rows = {conv_id: (["Conversation", f"c{conv_id}", airline_id, start, end], [])
+                for conv_id, airline_id, start, end in self.conn.execute(
+                    "SELECT conv_id, airline_id, start, end FROM temp.keys CROSS JOIN conversations ON conv_id = key")}
+        for conv_id, tweet_id, position_type in self.conn.execute(
+                "SELECT conv_id, tweet_id, position_type FROM temp.keys CROSS JOIN conversation_edges ON conv_id = key "
+                "ORDER BY conv_id, position"):
+            rows[conv_id][1].append([f"c{conv_id}", tweet_id, "PART_OF", str(position_type)])
+        return rows
+
+    def put_conversation(self, conv_id, airline_id, component, trimmed, annotations, start, end):
+        self.conn.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?)",
+                          (conv_id, airline_id, int(component), start, end))
+        self.conn.execute("DELETE FROM conversation_edges WHERE conv_id = ?", (conv_id,))
+        self.conn.executemany("INSERT INTO conversation_edges VALUES (?, ?, ?, ?)",
+                              [(conv_id, position, tid, annotations.get(tid, 0))
+                               for position, tid in enumerate(trimmed)])
+
+    def delete_conversations(self, conv_ids):
+        self.conn.executemany("DELETE FROM conversations WHERE conv_id = ?", [(conv_id,) for conv_id in conv_ids])
+        self.conn.executemany("DELETE FROM conversation_edges WHERE conv_id = ?", [(conv_id,) for conv_id in conv_ids])
+
+    def export(self, conv_path, edge_path, conv_header, edge_header):
+        """
+        Write every current conversation to conv_path and edge_path, in conversation id order.
+        Returns the number of conversations.
+        """
+        for path, header, query in (
+            (conv_path, conv_header,
+             "SELECT 'Conversation', 'c' || conv_id, airline_id, start, end FROM conversations ORDER BY conv_id"),
+            (edge_path, edge_header,
+             "SELECT 'c' || conv_id, tweet_id, 'PART_OF', position_type FROM conversation_edges "
+             "ORDER BY conv_id, position"),
+        ):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(self.conn.execute(query))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return self.conn.execute("SELECT count(*) FROM conversations").fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def open_state(output_dir):
+    """
+    The state of the last build in output_dir, or None if there is none.
+    """
+    path = state_path(output_dir)
+    if not os.path.exists(path):
+        return None
+    return ConversationState(path)
+
+def new_state(output_dir):
+    """
+    An empty state next to the current one, which install_state swaps in once it's complete,
+    so every full build starts from a compact store and a failed build leaves the old one.
+    """
+    os.makedirs(os.path.join(output_dir, STATE_DIRNAME), exist_ok=True)
+    path = state_path(output_dir) + ".tmp"
+    if os.path.exists(path):
+        os.remove(path)
+    return ConversationState(path)
+
+def install_state(state, output_dir):
+    state.commit()
+    state.close()
+    os.replace(state.path, state_path(output_dir))
+
+def input_offsets(import_dir):
+    """
+    Byte offset of every input file at to_csv.py's last checkpoint. Refuses to go on while
+    a file holds rows past it: those of an ingest that is still running, or of a crashed
+    one that the next --incremental run rolls back. CSVs without an ingest manifest are
+    taken as they are.
+    """
+    sizes = {name: os.path.getsize(os.path.join(import_dir, name)) for name in INPUT_FILES}
+    manifest = load_manifest(import_dir)
+    if manifest is None:
+        return sizes
+    offsets = {name: manifest["offsets"].get(name) for name in INPUT_FILES}
+    unchecked = [name for name in INPUT_FILES if offsets[name] != sizes[name]]
+    if unchecked:
+        raise RuntimeError(f"{', '.join(unchecked)} in {import_dir} differ from the last ingest checkpoint, "
+                           f"let to_csv.py finish (or rerun it with --incremental after a crash) first")
+    return offsets
+
+def read_new_rows(import_dir, name, start, end, usecols):
+    """
+    The rows of an import CSV between the offsets of two checkpoints, as string columns.
+    """
+    path = os.path.join(import_dir, name)
+    if os.path.getsize(path) < end:
+        raise RuntimeError(f"{path} is shorter than at the last build, run a full build instead of --delta")
+    if start > end:
+        raise RuntimeError(f"{path} was cut back since the last build, run a full build instead of --delta")
+    if start == end:
+        return pd.DataFrame({i: pd.Series(dtype=str) for i in usecols})
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(data), header=None, dtype=str, usecols=usecols, keep_default_na=False,
+                       encoding="utf-8")
@@ -0,0 +1,132 @@
+import time
+import threading
+
+NUM_SHARDS = 64
+
+class ShardedSet:
+    """
+    Set split into hash partitions that each have their own lock, so producer
+    threads deduplicating different ids almost never wait on each other.
+    """
+    def __init__(self, num_shards=NUM_SHARDS):
+        self.shards = [set() for _ in range(num_shards)]
+        self.locks = [threading.Lock() for _ in range(num_shards)]
+        self.lock_wait = 0.0  # seconds spent waiting on contended shard locks, approximate
+
+    def _index(self, key):
+        return hash(key) % len(self.shards)
+
+    def _acquire(self, i):
+        # Only a contended acquire pays for the timing
+        lock = self.locks[i]
+        if not lock.acquire(blocking=False):
+            start = time.perf_counter()
+            lock.acquire()
+            self.lock_wait += time.perf_counter() - start
+        return lock
+
+    def add(self, key):
+        """
+        Add key to its shard. Returns True if the key was new, False if it was already present.
+        """
+        i = self._index(key)
+        shard = self.shards[i]
+        lock = self._acquire(i)
+        try:
+            if key in shard:
+                return False
+            shard.add(key)
+            return True
+        finally:
+            lock.release()
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        # A single membership test is atomic, no lock needed
+        return key in self.shards[self._index(key)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+def _compact(tid):
+    # Numeric ids are stored as ints, about half the memory of the string
+    return int(tid) if tid.isdigit() and tid[0] != "0" else tid
+
+class TweetIndex(ShardedSet):
+    """
+    Sharded set of tweet ids that also parks replies whose parent tweet hasn't
+    been seen yet. A parked reply lives in its parent's shard, so the parent
+    can't arrive between the check and the parking.
+    """
+    def __init__(self, num_shards=NUM_SHARDS):
+        super().__init__(num_shards)
+        # parent id -> child id, or a list of child ids when several replies are waiting
+        self.pending = [{} for _ in range(num_shards)]
+        # Parked replies per shard, kept under the shard's lock so pending_count needn't walk the dicts
+        self.pending_sizes = [0] * num_shards
+
+    def add_tweet(self, tid):
+        """
+        Add tid. Returns (is_new, children) where children are the parked replies to tid.
+        """
+        i = self._index(tid)
+        lock = self._acquire(i)
+        try:
+            if tid in self.shards[i]:
+                return False, []
+            self.shards[i].add(tid)
+            waiting = self.pending[i].pop(_compact(tid), None)
+            if waiting is not None:
+                self.pending_sizes[i] -= len(waiting) if isinstance(waiting, list) else 1
+        finally:
+            lock.release()
+        if waiting is None:
+            return True, []
+        if isinstance(waiting, list):
+            return True, [str(child) for child in waiting]
+        return True, [str(waiting)]
+
+    def link(self, child, parent):
+        """
+        Returns True if parent is already known, so the REPLIES edge can be written
+        right away. Otherwise the reply is parked until add_tweet(parent).
+        """
+        i = self._index(parent)
+        lock = self._acquire(i)
+        try:
+            if parent in self.shards[i]:
+                return True
+            pending = self.pending[i]
+            key, value = _compact(parent), _compact(child)
+            existing = pending.get(key)
+            if existing is None:
+                pending[key] = value
+            elif isinstance(existing, list):
+                existing.append(value)
+            else:
+                pending[key] = [existing, value]
+            self.pending_sizes[i] += 1
+            return False
+        finally:
+            lock.release()
+
+    def pending_count(self):
+        # Safe to call from another thread, e.g. a metrics gauge, while producers park replies
+        return sum(self.pending_sizes)
+
+    def drain_pending(self):
+        """
+        Remove and return the replies still waiting for a parent, as (child, parent) pairs.
+        """
+        pairs = []
+        for i, pending in enumerate(self.pending):
+            with self.locks[i]:
+                for parent, children in pending.items():
+                    for child in (children if isinstance(children, list) else [children]):
+                        pairs.append((str(child), str(parent)))
+                pending.clear()
+                self.pending_sizes[i] = 0
+        return pairs
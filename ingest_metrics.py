@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class Metrics:
+    """
+    Counters, accumulated stage timings and sampled gauges for the ingestion
+    pipeline. Snapshots can be appended to a JSON lines file or written as a
+    Prometheus textfile (node_exporter textfile collector) on a fixed interval.
+    """
+    def __init__(self, prefix="ingest"):
+        self.prefix = prefix
+        self.start_time = time.perf_counter()
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.reporter = None
+        self.stop_event = threading.Event()
+        self.last_snapshot = None
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def merge(self, counters, timings):
+        """
+        Fold in the counters and timings of another Metrics, e.g. one returned by a worker process.
+        """
+        for name, value in counters.items():
+            self.incr(name, value)
+        for name, value in timings.items():
+            self.add_time(name, value)
+
+    def drain(self):
+        """
+        Return the counters and timings so far and start again from zero, e.g. to send a
+        worker's progress to the parent's Metrics in pieces.
+        """
+        with self.lock:
+            counters, timings = self.counters, self.timings
+            self.counters, self.timings = {}, {}
+        return counters, timings
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def gauge(self, name, fn):
+        """
+        Register a callable sampled at every snapshot, e.g. a queue's qsize.
+        """
+        self.gauges[name] = fn
+
+    def snapshot(self):
+        now = time.perf_counter()
+        with self.lock:
+            counters = dict(self.counters)
+            timings = dict(self.timings)
+        snap = {
+            "time": time.time(),
+            "elapsed": round(now - self.start_time, 3),
+            "counters": counters,
+            "seconds": {name: round(value, 3) for name, value in timings.items()},
+            "gauges": {name: fn() for name, fn in self.gauges.items()},
+        }
+        # Rates over the interval since the previous snapshot
+        previous = self.last_snapshot
+        if previous is not None and snap["elapsed"] > previous["elapsed"]:
+            interval = snap["elapsed"] - previous["elapsed"]
+            snap["rates"] = {
+                name: round((value - previous["counters"].get(name, 0)) / interval, 1)
+                for name, value in counters.items()
+            }
+        self.last_snapshot = snap
+        return snap
+
+    def write_jsonl(self, path, snap):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snap) + "\n")
+
+    def write_prometheus(self, path, snap):
+        lines = []
+        for name, value in snap["counters"].items():
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        for name, value in snap["seconds"].items():
+            lines.append(f"# TYPE {self.prefix}_{name}_seconds_total counter")
+            lines.append(f"{self.prefix}_{name}_seconds_total {value}")
+        for name, value in snap["gauges"].items():
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        lines.append(f"{self.prefix}_elapsed_seconds {snap['elapsed']}")
+        # Written next to the target and renamed, so the collector never reads half a file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def report(self, path):
+        snap = self.snapshot()
+        if path.endswith(".prom"):
+            self.write_prometheus(path, snap)
+        else:
+            self.write_jsonl(path, snap)
+        return snap
+
+    def start_reporter(self, path, interval=10.0):
+        """
+        Write a snapshot to path every interval seconds until stop_reporter().
+        Paths ending in .prom get the Prometheus format, anything else JSON lines.
+        """
+        def run():
+            while not self.stop_event.wait(interval):
+                # A failing gauge or write only costs this snapshot, not the rest of the run's reporting
+                try:
+                    self.report(path)
+                except Exception:
+                    logger.exception(f"Metrics snapshot to {path} failed")
+
+        self.reporter = threading.Thread(target=run, daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self, path=None):
+        if self.reporter is not None:
+            self.stop_event.set()
+            self.reporter.join()
+            self.reporter = None
+        if path:
+            self.report(path)
+
+    def summary(self, stages):
+        """
+        End-of-run report. stages maps a stage name to (busy_seconds_key, workers):
+        the stage with the highest busy share is the likely bottleneck.
+        """
+        snap = self.snapshot()
+        elapsed = max(snap["elapsed"], 1e-9)
+        lines = [f"Finished in {elapsed:.1f}s"]
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"  {name:<32} {value:>14,}  ({value / elapsed:,.1f}/s)")
+        for name, value in sorted(snap["seconds"].items()):
+            lines.append(f"  {name:<32} {value:>13.1f}s")
+
+        utilisation = {}
+        for stage, (key, workers) in stages.items():
+            busy = snap["seconds"].get(key, 0.0)
+            utilisation[stage] = busy / (elapsed * max(workers, 1))
+        if utilisation:
+            lines.append("  stage utilisation: " + ", ".join(f"{stage} {share:.0%}" for stage, share in utilisation.items()))
+            bottleneck = max(utilisation, key=utilisation.get)
+            lines.append(f"  likely bottleneck: {bottleneck}")
+        return "\n".join(lines)
@@ -0,0 +1,206 @@
+import os
+import csv
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from parquet_output import list_parts, remove_parts
+
+STATE_DIRNAME = ".ingest_state"
+PARQUET_DIRNAME = "parquet"
+MANIFEST_NAME = "manifest.json"
+OUTPUT_FILES = ["users.csv", "tweets.csv", "posted.csv", "replies.csv", "retweeted.csv"]
+
+# Node ids are logged next to the CSVs, so the dedup state can be reloaded without parsing the multi-line text columns
+ID_LOGS = {"users.csv": "user_ids.txt", "tweets.csv": "tweet_ids.txt"}
+# Replies parked because their parent wasn't ingested yet, as child,parent lines
+PENDING_LOG = "pending_replies.txt"
+COMPACTED_SUFFIX = ".compacted"  # the rewritten pending log, until it replaces the old one
+
+def state_dir(output_dir):
+    return os.path.join(output_dir, STATE_DIRNAME)
+
+def file_checksum(path, block_size=16 * 1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(output_dir):
+    """
+    The manifest records every fully ingested input file (size, mtime, sha1) and the
+    byte offset of every output file at the last checkpoint, and with --parquet the part
+    files of every dataset at that checkpoint. Returns None if there is none.
+    """
+    path = os.path.join(state_dir(output_dir), MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    os.makedirs(state_dir(output_dir), exist_ok=True)
+    path = os.path.join(state_dir(output_dir), MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def is_processed(manifest, path):
+    """
+    True if path was ingested before and is unchanged. Size and mtime are enough
+    for the common case, the checksum settles files that were touched but not changed.
+    """
+    entry = manifest["files"].get(path)
+    if entry is None:
+        return False
+    stat = os.stat(path)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime == entry["mtime"]:
+        return True
+    return file_checksum(path) == entry["sha1"]
+
+def rollback_outputs(output_dir, manifest):
+    """
+    Cut every output file and id log back to the last checkpoint, dropping the
+    partial rows of a crashed run. The files that were in flight are simply ingested again.
+    """
+    # A run that got as far as compacting the pending log had committed everything else
+    pending_path = os.path.join(state_dir(output_dir), PENDING_LOG)
+    if os.path.exists(pending_path + COMPACTED_SUFFIX):
+        manifest["offsets"][os.path.join(STATE_DIRNAME, PENDING_LOG)] = os.path.getsize(pending_path + COMPACTED_SUFFIX)
+        save_manifest(output_dir, manifest)
+        os.replace(pending_path + COMPACTED_SUFFIX, pending_path)
+    for name, offset in manifest["offsets"].items():
+        path = os.path.join(output_dir, name)
+        if not os.path.exists(path):
+            raise RuntimeError(f"{path} is missing, run a full ingest instead of --incremental")
+        if os.path.getsize(path) > offset:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+    # Parquet files flushed after the checkpoint hold rows that are ingested again
+    for name, parts in manifest.get("parquet", {}).items():
+        remove_parts(os.path.join(output_dir, PARQUET_DIRNAME, name), set(parts))
+
+def discard_compacted_pending(output_dir):
+    # A compacted pending log that a crashed run left behind, before a full run replaces all outputs
+    path = os.path.join(state_dir(output_dir), PENDING_LOG + COMPACTED_SUFFIX)
+    if os.path.exists(path):
+        os.remove(path)
+
+def load_dedup_state(output_dir):
+    """
+    Rebuild the dedup sets of earlier runs: node ids from the id logs, edges from posted.csv, replies.csv and retweeted.csv.
+    "pending" holds the parked replies that are still unresolved.
+    """
+    def read_ids(name):
+        path = os.path.join(state_dir(output_dir), name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+
+    def read_edges(name):
+        path = os.path.join(output_dir, name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            return [(row[0], row[1]) for row in reader]
+
+    replies = read_edges("replies.csv")
+    written = set(replies)
+    parked = [tuple(line.split(",")) for line in read_ids(PENDING_LOG)]
+    return {
+        "users": read_ids(ID_LOGS["users.csv"]),
+        "tweets": read_ids(ID_LOGS["tweets.csv"]),
+        "posted": read_edges("posted.csv"),
+        "replies": replies,
+        "retweeted": read_edges("retweeted.csv"),
+        "pending": list(dict.fromkeys(pair for pair in parked if pair not in written)),
+    }
+
+class IngestCheckpoint:
+    """
+    Tracks which read tasks are done and records a checkpoint in the manifest
+    whenever the last task of an input file has been written out.
+    Checksums of the new files are computed on a background thread while they are ingested.
+    Parquet sinks, if any, are flushed at every checkpoint and their part files recorded.
+    compact_pending() rewrites the pending log once a run is done.
+    """
+    def __init__(self, output_dir, manifest, tasks, sinks=None):
+        self.output_dir = output_dir
+        self.manifest = manifest
+        self.sinks = sinks or {}
+        # Parts of earlier runs; a dataset without a record so far keeps the parts already on disk
+        recorded = manifest.get("parquet", {})
+        self.parquet_parts = {
+            name: list(recorded[name]) if name in recorded else sorted(list_parts(sink.path))
+            for name, sink in self.sinks.items()
+        }
+        self.pending = {}
+        for path, _, _ in tasks:
+            self.pending[path] = self.pending.get(path, 0) + 1
+        self.hasher = ThreadPoolExecutor(max_workers=1)
+        self.checksums = {path: self.hasher.submit(file_checksum, path) for path in self.pending}
+        self.lock = threading.Lock()
+
+    def task_done(self, task, handles):
+        """
+        Called by the writer once every row of task has been written. handles maps
+        output names (CSV files and id logs) to their open file objects.
+        """
+        path = task[0]
+        with self.lock:
+            self.pending[path] -= 1
+            if self.pending[path] > 0:
+                return
+            del self.pending[path]
+            self.commit(handles, [path])
+
+    def commit(self, handles, completed_paths=()):
+        for f in handles.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.manifest["offsets"] = {name: f.tell() for name, f in handles.items()}
+        if self.sinks:
+            for sink in self.sinks.values():
+                sink.flush()
+            self.manifest.setdefault("parquet", {}).update(
+                {name: self.parquet_parts[name] + sink.parts for name, sink in self.sinks.items()})
+        for path in completed_paths:
+            stat = os.stat(path)
+            self.manifest["files"][path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha1": self.checksums[path].result(),
+            }
+        save_manifest(self.output_dir, self.manifest)
+
+    def compact_pending(self, pairs):
+        """
+        Replace the pending log with the replies still unresolved at the end of a run, so
+        replies resolved since they were parked don't pile up in it. Called once every
+        output is closed; the manifest offset follows the new size.
+        """
+        path = os.path.join(state_dir(self.output_dir), PENDING_LOG)
+        compacted_path = path + COMPACTED_SUFFIX
+        tmp_path = compacted_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{child},{parent}\n" for child, parent in dict.fromkeys(pairs))
+            f.flush()
+            os.fsync(f.fileno())
+        # Complete from here on: rollback_outputs swaps it in if a crash stops us before that
+        os.replace(tmp_path, compacted_path)
+        with self.lock:
+            self.manifest["offsets"][os.path.join(STATE_DIRNAME, PENDING_LOG)] = os.path.getsize(compacted_path)
+            save_manifest(self.output_dir, self.manifest)
+        os.replace(compacted_path, path)
+
+    def close(self):
+        self.hasher.shutdown()
@@ -0,0 +1,294 @@
+import os
+import csv
+import queue
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from airlines import airline_ids
+from building_conversations import (CONVERSATION_EDGES_HEADER, CONVERSATIONS_HEADER, annotate_positions, csv_writer,
+                                    trim_conversation)
+from conversation_order import order_component, tweet_time
+from conversation_state import input_offsets, install_state, new_state, open_state, read_new_rows
+from reply_components import load_edges, reply_components
+
+IMPORT_DIR = "import"
+CHANGES_DIRNAME = "conversation_changes"  # one changeset per --delta run
+
+logger = logging.getLogger(__name__)
+
+def group_slices(keys, n_groups):
+    """
+    Stable sort of keys plus the [start, end) bounds of every group in it.
+    """
+    order = np.argsort(keys, kind="stable")
+    bounds = np.searchsorted(keys[order], np.arange(n_groups + 1))
+    return order, bounds
+
+def load_created_at(path):
+    """
+    created_at of every tweet, as written to tweets.csv, indexed by tweet id.
+    """
+    df = pd.read_csv(path, dtype=str, usecols=[1, 3], keep_default_na=False)
+    return pd.Series(df.iloc[:, 1].values, index=df.iloc[:, 0].values)
+
+def find_conversations(replies, posted, airline_ids, key=None, components=None):
+    """
+    The conversations building_conversations.py finds in Neo4j, computed from the
+    import CSVs: yields (airline_id, trimmed, annotations) per conversation.
+    key orders replies and roots, see conversation_order.order_component.
+    components is the result of reply_components(replies), if the caller has it already.
+    """
+    tweet_ids, labels = components if components is not None else reply_components(replies)
+    if len(tweet_ids) == 0:
+        return
+
+    index = pd.Index(tweet_ids)
+    n_components = labels.max() + 1
+    sizes = np.bincount(labels, minlength=n_components)
+    tweet_order, tweet_bounds = group_slices(labels, n_components)
+
+    parents = index.get_indexer(replies["end"])
+    children = index.get_indexer(replies["start"])
+    edge_order, edge_bounds = group_slices(labels[parents], n_components)
+
+    ordered_components = {}
+
+    def ordered_component(label):
+        # A component with tweets of several airlines is only ordered once
+        if label not in ordered_components:
+            members = tweet_order[tweet_bounds[label]:tweet_bounds[label + 1]]
+            edges = edge_order[edge_bounds[label]:edge_bounds[label + 1]]
+            children_map = {}
+            for parent, child in zip(parents[edges], children[edges]):
+                children_map.setdefault(tweet_ids[parent], []).append(tweet_ids[child])
+            ordered_components[label] = order_component(tweet_ids[members].tolist(), children_map, key)
+        return ordered_components[label]
+
+    for airline_id in airline_ids:
+        airline_tweet_ids = set(posted.loc[posted["start"] == airline_id, "end"])
+        is_airline = index.isin(airline_tweet_ids)
+        airline_counts = np.bincount(labels[is_airline], minlength=n_components)
+        # A conversation needs an airline tweet with another tweet on either side
+        candidates = np.flatnonzero((sizes >= 3) & (airline_counts > 0) & (airline_counts < sizes))
+
+        found = 0
+        for label in candidates:
+            trimmed = trim_conversation(ordered_component(label), airline_tweet_ids)
+            if trimmed is not None:
+                found += 1
+                yield airline_id, trimmed, annotate_positions(trimmed, airline_tweet_ids)
+        logger.info(f"Airline {airline_id}: {found} conversations from {len(candidates)} components")
+
+def load_replies(import_dir):
+    # Same edges the REPLIES graph has after the import, without parallel duplicates
+    return load_edges(os.path.join(import_dir, "replies.csv")).drop_duplicates(ignore_index=True)
+
+def time_key(created_at):
+    return lambda tid: tweet_time(created_at.get(tid))
+
+def write_conversations(conversations, created_at, output_dir, parquet=False):
+    """
+    Write (airline_id, trimmed, annotations) tuples through csv_writer, numbered c1, c2, ...
+    in the order given.
+    """
+    conversation_queue = queue.Queue()
+    for airline_id, trimmed, annotations in conversations:
+        conversation_queue.put((airline_id, trimmed, annotations,
+                                created_at.get(trimmed[0]), created_at.get(trimmed[-1])))
+    conversation_queue.put("DONE")
+    csv_writer(conversation_queue, parquet, output_dir)
+
+def build(import_dir=IMPORT_DIR, output_dir=IMPORT_DIR, parquet=False, chronological=False):
+    """
+    Write conversations.csv and conversation_edges.csv from replies.csv, posted.csv
+    and tweets.csv, without a database. Also records the state --delta continues from.
+    Returns the number of conversations.
+    """
+    offsets = input_offsets(import_dir)
+    replies = load_replies(import_dir)
+    posted = load_edges(os.path.join(import_dir, "posted.csv"))
+    posted = posted[posted["start"].isin(set(airline_ids))]
+    created_at = load_created_at(os.path.join(import_dir, "tweets.csv"))
+    tweet_ids, labels = reply_components(replies)
+
+    key = time_key(created_at) if chronological else None
+    conversations = list(find_conversations(replies, posted, airline_ids, key, (tweet_ids, labels)))
+    write_conversations(conversations, created_at, output_dir, parquet)
+
+    # A fresh store each build, so updates of earlier --delta runs don't pile up
+    state = new_state(output_dir)
+    state.put_tweets(created_at.index, created_at.values)
+    state.put_airline_tweets(posted["end"], posted["start"])
+    state.add_replies(replies["start"], replies["end"])
+    del replies
+    state.put_components(tweet_ids, labels)
+    component_of = dict(zip(tweet_ids, labels.tolist()))
+    for conv_id, (airline_id, trimmed, annotations) in enumerate(conversations, 1):
+        state.put_conversation(conv_id, airline_id, component_of[trimmed[0]], trimmed, annotations,
+                               created_at.get(trimmed[0], ""), created_at.get(trimmed[-1], ""))
+    state.save_meta({
+        "offsets": offsets,
+        "chronological": chronological,
+        "run": 0,
+        "next_component": int(labels.max()) + 1 if len(labels) else 0,
+        "next_conversation": len(conversations) + 1,
+    })
+    install_state(state, output_dir)
+    return len(conversations)
+
+def merge_components(tweet_ids, labels, membership, next_component):
+    """
+    Component ids for recomputed components: a component keeps the smallest id of the
+    earlier components it contains, components of only new tweets get new ids.
+    Returns (ids per tweet, earlier id -> new id, next free id).
+    """
+    df = pd.DataFrame({"label": labels, "old": membership.reindex(tweet_ids).values})
+    ids = df.groupby("label")["old"].min().reindex(range(labels.max() + 1 if len(labels) else 0))
+    new = ids.isna().values
+    ids[new] = np.arange(next_component, next_component + new.sum())
+    ids = ids.astype(np.int64).values
+    renamed = df.dropna().astype({"old": np.int64})
+    return ids[labels], dict(zip(renamed["old"], ids[renamed["label"]])), next_component + int(new.sum())
+
+def delta(import_dir=IMPORT_DIR, output_dir=IMPORT_DIR):
+    """
+    Update the conversations of an earlier build with the rows to_csv.py --incremental
+    appended since: only the reply components touched by new replies are rebuilt, and
+    only their rows are read from the state. Writes the added, changed and removed
+    conversations to conversation_changes/, export() brings conversations.csv and
+    conversation_edges.csv up to date. Returns the change counts.
+    """
+    state = open_state(output_dir)
+    if state is None:
+        raise RuntimeError(f"No conversation state in {output_dir}, run a full build first")
+    meta = state.load_meta()
+    offsets = input_offsets(import_dir)
+
+    # Only the rows between the checkpoints of the last build and of the ingest since
+    new_tweets, new_posted, new_replies = (
+        read_new_rows(import_dir, name, meta["offsets"][name], offsets[name], usecols)
+        for name, usecols in (("tweets.csv", [1, 3]), ("posted.csv", [0, 1]), ("replies.csv", [0, 1]))
+    )
+    new_posted = new_posted[new_posted[0].isin(set(airline_ids))]
+    state.put_tweets(new_tweets[1], new_tweets[3])
+    state.put_airline_tweets(new_posted[1], new_posted[0])
+    state.add_replies(new_replies[0], new_replies[1])
+
+    # Tweets of the earlier components that new replies or airline tweets reach
+    touched = set(new_replies[0]) | set(new_replies[1]) | set(new_posted[1])
+    old_components = set(state.components_of(touched))
+    affected = touched | set(state.members(old_components))
+    membership = state.components_of(affected)
+
+    # Components are closed under REPLIES, so the child of an edge decides
+    replies = state.replies_of(affected)
+    tweet_ids, labels = reply_components(replies)
+    component_ids, renamed, meta["next_component"] = merge_components(tweet_ids, labels, membership,
+                                                                     meta["next_component"])
+    state.put_components(tweet_ids, component_ids)
+    component_of = dict(zip(tweet_ids, component_ids.tolist()))
+
+    posted = state.airline_tweets(affected)
+    created_at = state.created_at(affected)
+    key = time_key(created_at) if meta["chronological"] else None
+    conversations = find_conversations(replies, posted, airline_ids, key, (tweet_ids, labels))
+
+    # An airline has at most one conversation per component, merged components keep the smallest earlier id
+    earlier = {}
+    for conv_id, airline_id, component in state.conversations_in(old_components):
+        earlier.setdefault((airline_id, renamed[component]), []).append(conv_id)
+    for conv_ids in earlier.values():
+        conv_ids.sort()
+    old_rows = state.conversation_rows([conv_id for conv_ids in earlier.values() for conv_id in conv_ids])
+
+    new_rows, updated = {}, {}
+    for airline_id, trimmed, annotations in conversations:
+        component = component_of[trimmed[0]]
+        conv_ids = earlier.pop((airline_id, component), None)
+        if conv_ids:
+            conv_id = conv_ids[0]
+            updated[conv_id] = "changed"
+            earlier[(airline_id, component)] = conv_ids[1:]
+        else:
+            conv_id = meta["next_conversation"]
+            meta["next_conversation"] += 1
+            updated[conv_id] = "added"
+        start, end = created_at.get(trimmed[0], ""), created_at.get(trimmed[-1], "")
+        state.put_conversation(conv_id, airline_id, component, trimmed, annotations, start, end)
+        # As strings, the way they read back from the CSV
+        new_rows[conv_id] = (["Conversation", f"c{conv_id}", airline_id, start, end],
+                             [[f"c{conv_id}", tid, "PART_OF", str(annotations.get(tid, 0))] for tid in trimmed])
+    removed = [conv_id for conv_ids in earlier.values() for conv_id in conv_ids]
+    state.delete_conversations(removed)
+
+    # Rebuilt conversations that came out the same are left out of the changeset
+    for conv_id, change in updated.items():
+        if change == "changed" and old_rows.get(conv_id) == new_rows[conv_id]:
+            updated[conv_id] = "unchanged"
+
+    meta["run"] += 1
+    changes_dir = os.path.join(output_dir, CHANGES_DIRNAME)
+    os.makedirs(changes_dir, exist_ok=True)
+    with open(os.path.join(changes_dir, f"{meta['run']:04d}_conversations.csv"), "w", newline="", encoding="utf-8") as conv_file, \
+         open(os.path.join(changes_dir, f"{meta['run']:04d}_conversation_edges.csv"), "w", newline="", encoding="utf-8") as edge_file:
+        conv_writer = csv.writer(conv_file)
+        edge_writer = csv.writer(edge_file)
+        conv_writer.writerow(CONVERSATIONS_HEADER + ["change"])
+        edge_writer.writerow(CONVERSATION_EDGES_HEADER)
+        for conv_id, change in updated.items():
+            if change != "unchanged":
+                conv_writer.writerow(new_rows[conv_id][0] + [change])
+                edge_writer.writerows(new_rows[conv_id][1])
+        for conv_id in removed:
+            conv_writer.writerow(old_rows[conv_id][0] + ["removed"])
+
+    meta["offsets"] = offsets
+    state.save_meta(meta)
+    state.commit()
+    state.close()
+    counts = {change: sum(1 for value in updated.values() if value == change) for change in ("added", "changed")}
+    counts["removed"] = len(removed)
+    return counts
+
+def export(output_dir=IMPORT_DIR):
+    """
+    Rewrite conversations.csv and conversation_edges.csv from the state, with the updates
+    of every --delta run since the last full build. Returns the number of conversations.
+    """
+    state = open_state(output_dir)
+    if state is None:
+        raise RuntimeError(f"No conversation state in {output_dir}, run a full build first")
+    count = state.export(os.path.join(output_dir, "conversations.csv"),
+                         os.path.join(output_dir, "conversation_edges.csv"),
+                         CONVERSATIONS_HEADER, CONVERSATION_EDGES_HEADER)
+    state.close()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build airline conversations from the to_csv.py outputs, without Neo4j.")
+    parser.add_argument("--input", default=IMPORT_DIR, help="directory with replies.csv, posted.csv and tweets.csv")
+    parser.add_argument("--output", default=IMPORT_DIR, help="directory to write conversations.csv and conversation_edges.csv to")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also write conversations and conversation_edges as Parquet datasets (needs pyarrow)")
+    parser.add_argument("--chronological", action="store_true",
+                        help="order every reply tree by created_at instead of the reply graph's own order")
+    parser.add_argument("--delta", action="store_true",
+                        help="only rebuild the reply components touched since the last build and write a changeset")
+    parser.add_argument("--export", action="store_true",
+                        help="rewrite conversations.csv and conversation_edges.csv with the updates of the --delta runs")
+    args = parser.parse_args()
+
+    if args.delta or args.export:
+        # The ordering of the full build is kept, Parquet datasets can't be patched in place
+        if args.parquet or args.chronological:
+            parser.error("--delta and --export take their settings from the last full build and write CSV only")
+    if args.delta:
+        counts = delta(args.input, args.output)
+        logger.info(f"Conversations added: {counts['added']}, changed: {counts['changed']}, removed: {counts['removed']}")
+    if args.export:
+        count = export(args.output)
+        logger.info(f"Wrote {count} conversations to {args.output}")
+    if not (args.delta or args.export):
+        count = build(args.input, args.output, args.parquet, args.chronological)
+        logger.info(f"Wrote {count} conversations to {args.output}")
@@ -0,0 +1,168 @@
+import os
+import uuid
+import shutil
+
+PARQUET_DIR = os.path.join("import", "parquet")
+ROWS_PER_FILE = 250_000  # rows buffered per dataset before a Parquet file is written
+COMPRESSION = "zstd"
+TWITTER_TS_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+# Column name, arrow type. Timestamps arrive as Twitter strings and are parsed on write.
+DATASETS = {
+    "users": [("userId", "string"), ("name", "string"), ("screen_name", "string"),
+              ("followers", "int64"), ("verified", "bool_")],
+    "tweets": [("tweetId", "string"), ("text", "string"), ("created_at", "timestamp"), ("lang", "string"),
+               ("type", "int8"), ("sentiment_label", "string"), ("sentiment_expected_value", "float32"),
+               ("sentiment_negative", "float32"), ("sentiment_neutral", "float32"), ("sentiment_positive", "float32")],
+    "posted": [("userId", "string"), ("tweetId", "string")],
+    "replies": [("tweetId", "string"), ("parentId", "string")],
+    "retweeted": [("userId", "string"), ("tweetId", "string"), ("created_at", "timestamp")],
+    "conversations": [("conversationId", "string"), ("airlineId", "string"),
+                      ("start", "timestamp"), ("end", "timestamp")],
+    "conversation_edges": [("conversationId", "string"), ("tweetId", "string"), ("positionType", "int8")],
+}
+
+# Datasets split into one directory per day, named after this timestamp column
+PARTITION_BY = {"tweets": "created_at", "conversations": "start"}
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def _arrow_column(pa, values, type_name):
+    if type_name == "timestamp":
+        strings = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+        return pa.compute.strptime(strings, format=TWITTER_TS_FORMAT, unit="s", error_is_null=True)
+    if type_name in ("int8", "int64"):
+        values = [None if v in ("", None) else int(v) for v in values]
+    elif type_name == "float32":
+        values = [None if v in ("", None) else float(v) for v in values]
+    elif type_name == "bool_":
+        values = [None if v in ("", None) else bool(int(v)) for v in values]
+    return pa.array(values, type=getattr(pa, type_name)())
+
+class ParquetSink:
+    """
+    Buffers rows for one dataset and writes them as compressed Parquet files
+    under PARQUET_DIR/<name>/, partitioned by day where PARTITION_BY says so.
+    Rows are tuples in the column order of DATASETS[name].
+    """
+    def __init__(self, name, root=PARQUET_DIR, append=False, rows_per_file=ROWS_PER_FILE):
+        self.pa = _require_pyarrow()
+        self.name = name
+        self.columns = DATASETS[name]
+        self.path = os.path.join(root, name)
+        self.rows_per_file = rows_per_file
+        self.rows = []
+        self.files_written = 0
+        self.parts = []  # ids of the part files written by this sink, see list_parts
+        if not append:
+            shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.rows_per_file:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        pa = self.pa
+        columns = list(zip(*self.rows))
+        arrays = [_arrow_column(pa, list(values), type_name) for values, (_, type_name) in zip(columns, self.columns)]
+        names = [name for name, _ in self.columns]
+
+        partition_cols = None
+        if self.name in PARTITION_BY:
+            ts = arrays[names.index(PARTITION_BY[self.name])]
+            arrays.append(pa.compute.strftime(ts, format="%Y-%m-%d"))
+            names.append("date")
+            partition_cols = ["date"]
+
+        table = pa.Table.from_arrays(arrays, names=names)
+        part = uuid.uuid4().hex
+        pa.parquet.write_to_dataset(
+            table, self.path, partition_cols=partition_cols, compression=COMPRESSION,
+            basename_template=f"part-{part}-{{i}}.parquet",
+        )
+        self.files_written += 1
+        self.parts.append(part)
+        self.rows.clear()
+
+    def close(self):
+        self.flush()
+
+def _part_id(filename):
+    # part-<id>-<i>.parquet, one id per flush whatever the number of partitions it touched
+    if filename.startswith("part-") and filename.endswith(".parquet"):
+        return filename.split("-")[1]
+    return None
+
+def list_parts(path):
+    """
+    Ids of the part files in a dataset directory.
+    """
+    parts = set()
+    for _, _, filenames in os.walk(path):
+        parts.update(part for part in map(_part_id, filenames) if part is not None)
+    return parts
+
+def remove_parts(path, keep):
+    """
+    Delete the part files of a dataset whose id is not in keep. Returns how many were deleted.
+    """
+    removed = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            part = _part_id(filename)
+            if part is not None and part not in keep:
+                os.remove(os.path.join(dirpath, filename))
+                removed += 1
+    return removed
+
+def open_sinks(names, append=False, root=PARQUET_DIR):
+    return {name: ParquetSink(name, root, append) for name in names}
+
+def close_sinks(sinks):
+    for sink in sinks.values():
+        sink.close()
+
+def read_dataset(name, columns=None, filters=None, root=PARQUET_DIR):
+    """
+    Load a dataset as a pandas DataFrame, reading only the given columns and the
+    partitions that match filters, e.g. filters=[("date", ">=", "2019-05-22")].
+    """
+    pa = _require_pyarrow()
+    import pyarrow.dataset as ds
+    partitioning = None
+    if name in PARTITION_BY:
+        partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    dataset = ds.dataset(os.path.join(root, name), format="parquet", partitioning=partitioning)
+
+    expression = None
+    for column, op, value in filters or []:
+        field = ds.field(column)
+        if op == "in":
+            condition = field.isin(value)
+        elif op == "==":
+            condition = field == value
+        elif op == "!=":
+            condition = field != value
+        elif op == "<":
+            condition = field < value
+        elif op == "<=":
+            condition = field <= value
+        elif op == ">":
+            condition = field > value
+        elif op == ">=":
+            condition = field >= value
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
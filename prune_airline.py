@@ -0,0 +1,66 @@
+import os
+import csv
+import argparse
+from airlines import airline_ids
+from reply_components import airline_component_tweets, load_edges
+
+IMPORT_DIR = "import"
+PRUNED_DIR = os.path.join(IMPORT_DIR, "pruned")
+
+def filter_csv(src_path, dst_path, keep_row):
+    """
+    Copy a neo4j-admin CSV, header included, keeping only the rows keep_row accepts.
+    """
+    kept = total = 0
+    with open(src_path, "r", newline="", encoding="utf-8") as src, \
+         open(dst_path, "w", newline="", encoding="utf-8", buffering=8 * 1024 * 1024) as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        writer.writerow(next(reader))
+        for row in reader:
+            total += 1
+            if keep_row(row):
+                writer.writerow(row)
+                kept += 1
+    return kept, total
+
+def prune(import_dir=IMPORT_DIR, output_dir=PRUNED_DIR):
+    """
+    Keep only the reply components that can become an airline conversation
+    (see building_conversations.py) and the users that posted their tweets.
+    Writes the same import files to output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    replies = load_edges(os.path.join(import_dir, "replies.csv"))
+    posted = load_edges(os.path.join(import_dir, "posted.csv"))
+
+    keep_tweets = airline_component_tweets(replies, posted, airline_ids)
+    keep_users = set(posted.loc[posted["end"].isin(keep_tweets), "start"])
+    del replies, posted
+
+    outputs = [
+        ("tweets.csv", lambda row: row[1] in keep_tweets),
+        ("users.csv", lambda row: row[1] in keep_users),
+        ("posted.csv", lambda row: row[1] in keep_tweets),
+        # Both ends of a reply are in the same component, so checking the child is enough
+        ("replies.csv", lambda row: row[0] in keep_tweets),
+    ]
+    # Written with --collapse-retweets: retweets of kept tweets stay, along with the users who retweeted them
+    retweeted_path = os.path.join(import_dir, "retweeted.csv")
+    if os.path.exists(retweeted_path):
+        retweeted = load_edges(retweeted_path)
+        keep_users.update(retweeted.loc[retweeted["end"].isin(keep_tweets), "start"])
+        del retweeted
+        outputs.append(("retweeted.csv", lambda row: row[1] in keep_tweets))
+
+    for name, keep_row in outputs:
+        kept, total = filter_csv(os.path.join(import_dir, name), os.path.join(output_dir, name), keep_row)
+        share = kept / total if total else 0
+        print(f"{name}: kept {kept:,} of {total:,} rows ({share:.1%})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop everything from the import CSVs that can't end up in an airline conversation.")
+    parser.add_argument("--input", default=IMPORT_DIR, help="directory with the to_csv.py output")
+    parser.add_argument("--output", default=PRUNED_DIR, help="directory for the pruned import files")
+    args = parser.parse_args()
+    prune(args.input, args.output)
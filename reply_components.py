@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+def load_edges(path):
+    """
+    Read a neo4j-admin relationship CSV (start, end, type) as two string columns.
+    """
+    df = pd.read_csv(path, dtype=str, usecols=[0, 1], keep_default_na=False)
+    df.columns = ["start", "end"]
+    return df
+
+def reply_components(replies):
+    """
+    Weakly connected components of the REPLIES graph, computed in-process.
+    Returns (tweet_ids, labels): every tweet that takes part in a reply edge and its component label.
+    """
+    codes, tweet_ids = pd.factorize(pd.concat([replies["start"], replies["end"]], ignore_index=True))
+    n_edges = len(replies)
+    src, dst = codes[:n_edges], codes[n_edges:]
+    graph = coo_matrix((np.ones(n_edges, dtype=np.int8), (src, dst)), shape=(len(tweet_ids), len(tweet_ids)))
+    _, labels = connected_components(graph, directed=True, connection="weak")
+    return np.asarray(tweet_ids, dtype=object), labels
+
+def airline_component_tweets(replies, posted, airline_ids, min_size=3):
+    """
+    Tweet ids of the reply components that can yield a conversation: at least min_size
+    tweets, at least one posted by an airline account and at least one that isn't.
+    """
+    tweet_ids, labels = reply_components(replies)
+    if len(tweet_ids) == 0:
+        return set()
+
+    airline_tweets = set(posted.loc[posted["start"].isin(set(airline_ids)), "end"])
+    is_airline = np.fromiter((tid in airline_tweets for tid in tweet_ids), dtype=bool, count=len(tweet_ids))
+
+    n_components = labels.max() + 1
+    sizes = np.bincount(labels, minlength=n_components)
+    airline_counts = np.bincount(labels, weights=is_airline, minlength=n_components)
+    keep = (sizes >= min_size) & (airline_counts > 0) & (airline_counts < sizes)
+    return set(tweet_ids[keep[labels]])
@@ -1,101 +1,97 @@
+import argparse
+import numpy as np
 import pandas as pd
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch.nn.functional as F
 from tqdm import tqdm
 import time
-from neo4j import GraphDatabase
-from transformers import pipeline
-from datasets import Dataset
 import math
+from roberta_sentiment import get_sentiment_arrays
+from sentiment_service import SentimentService
 
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"Device set to use {device}")
+CSV_PATH = r"import/conversationsj.csv"
+SCORES_PATH = r"import/conversation_sentiment.csv"  # sentiment columns of every conversation start and end
+SENTIMENT_BATCH_SIZE = 512
+UPDATE_BATCH_SIZE = 1000
+SENTIMENT_COLUMNS = ["negative", "neutral", "positive", "label", "expected_value"]
 
-#Loads sentiment analysis model
-model_name = "cardiffnlp/twitter-roberta-base-sentiment-latest"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name).to(device)
-model.eval()
-
-#Loads the zero-shot classifier
-zero_shot_classifier = pipeline(
-    "zero-shot-classification",
-    model="joeddav/xlm-roberta-large-xnli",
-    device=0 ,
-    use_fast=False,
-    batch_size=16
-)
 candidate_labels = ["delayed flight", "lost baggage", "poor customer service", "ticket issue", "other", "cancelled flight", "uncomfortable flight", "trouble with refunds"]
 
-
-#Connecting to Neo4j
-uri = "bolt://localhost:7687"  
+#Neo4j connection details
+uri = "bolt://localhost:7687"
 user = "neo4j"
 password = "password"
-driver = GraphDatabase.driver(uri, auth=(user, password), database="databaseconversation")
-
-print("Loading data from CSVs")
-csv_path = r"import/conversationsj.csv"
-df = pd.read_csv(csv_path)
-
-#We only take the start and end of conversations
-df = df[df["relationship.positionType"].isin([1, 2])].copy()
-
-grouped_df = (
-    df.groupby(["conversation_node.id", "relationship.positionType"])
-    .agg({"connected_node.text": lambda texts: " ".join(str(t) for t in texts)})
-    .reset_index()
-)
-grouped_df.columns = ["conversation_id", "position_type", "text"]
-
-print("Starting preprocessing")
-grouped_df["clean_text"] = (
-    grouped_df["text"]
-    .fillna("")
-    .str.replace(r'@\S+', '@user', regex=True)
-    .str.replace(r'http\S+', 'http', regex=True)
-)
-
-texts = grouped_df["clean_text"].tolist()
-expected_values = []
-batch_size = 512
-
 
-start_time = time.time()
-print("Starting sentiment analysis")
-
-with torch.no_grad():
-    for i in tqdm(range(0, len(texts), batch_size), desc="Processing"):
-        batch_texts = texts[i:i+batch_size]
-        encoded = tokenizer(batch_texts, padding=True, truncation=True, max_length=128, return_tensors="pt")
-        encoded = {k: v.to(device) for k, v in encoded.items()}
-
-        outputs = model(**encoded)
-        probs = F.softmax(outputs.logits, dim=1)
-
-        for p in probs:
-            prob_dict = {model.config.id2label[j]: p[j].item() for j in range(len(p))}
-            expected_value = round(prob_dict["positive"] - prob_dict["negative"], 4)
-            expected_values.append(expected_value)
-
-
-grouped_df["sentiment_expected_value"] = expected_values
-
-
-hf_dataset = Dataset.from_pandas(grouped_df[["clean_text"]])
+_zero_shot_classifier = None
+
+#Loads the zero-shot classifier on first use, it is large and the sentiment run doesn't need it
+def get_zero_shot_classifier():
+    global _zero_shot_classifier
+    if _zero_shot_classifier is None:
+        import torch
+        from transformers import pipeline
+        device = 0 if torch.cuda.is_available() else -1
+        print(f"Loading zero-shot classifier on device {device}")
+        _zero_shot_classifier = pipeline(
+            "zero-shot-classification",
+            model="joeddav/xlm-roberta-large-xnli",
+            device=device,
+            use_fast=False,
+            batch_size=16
+        )
+    return _zero_shot_classifier
 
 #Applying zero-shot in batches
 def classify_batch(batch):
     texts = batch["clean_text"]
     if isinstance(texts, str):
         texts = [texts]
-    results = zero_shot_classifier(texts, candidate_labels, multi_label=False)
+    results = get_zero_shot_classifier()(texts, candidate_labels, multi_label=False)
     if isinstance(results, dict):
         results = [results]
     return {"predicted_category": [r["labels"][0] for r in results]}
 
+def load_conversation_texts(csv_path=CSV_PATH):
+    print("Loading data from CSVs")
+    df = pd.read_csv(csv_path)
+
+    #We only take the start and end of conversations
+    df = df[df["relationship.positionType"].isin([1, 2])].copy()
+
+    grouped_df = (
+        df.groupby(["conversation_node.id", "relationship.positionType"])
+        .agg({"connected_node.text": lambda texts: " ".join(str(t) for t in texts)})
+        .reset_index()
+    )
+    grouped_df.columns = ["conversation_id", "position_type", "text"]
+
+    print("Starting preprocessing")
+    grouped_df["clean_text"] = (
+        grouped_df["text"]
+        .fillna("")
+        .str.replace(r'@\S+', '@user', regex=True)
+        .str.replace(r'http\S+', 'http', regex=True)
+    )
+    return grouped_df
+
+def score_conversations(grouped_df, batch_size=SENTIMENT_BATCH_SIZE, client=None):
+    texts = grouped_df["clean_text"].tolist()
+    batches = (texts[i:i+batch_size] for i in range(0, len(texts), batch_size))
+
+    # Scores come from the shared sentiment cache where possible, so re-runs only score new conversations
+    if client is not None:
+        results = client.map_batches(batches)
+    else:
+        results = (get_sentiment_arrays(batch_texts, batch_size=batch_size) for batch_texts in batches)
+    columns = {name: [] for name in SENTIMENT_COLUMNS}
+    for arrays in tqdm(results, total=math.ceil(len(texts) / batch_size), desc="Processing"):
+        for name in SENTIMENT_COLUMNS:
+            columns[name].append(arrays[name])
+
+    # The class probabilities are kept, so other sentiment scores can be derived without the model
+    for name, parts in columns.items():
+        grouped_df[f"sentiment_{name}"] = np.concatenate(parts) if parts else []
+    return grouped_df
+
 
 #Updating Neo4j with the new attributes
 def update_conversations_batch(tx, batch_data):
@@ -105,7 +101,9 @@ def update_conversations_batch(tx, batch_data):
         WHERE id(c) = row.conv_id
         WITH c, row
         SET c.start_sentiment = CASE WHEN row.position_type = 1 THEN row.sentiment ELSE c.start_sentiment END,
-            c.end_sentiment = CASE WHEN row.position_type = 2 THEN row.sentiment ELSE c.end_sentiment END
+            c.end_sentiment = CASE WHEN row.position_type = 2 THEN row.sentiment ELSE c.end_sentiment END,
+            c.start_probabilities = CASE WHEN row.position_type = 1 THEN row.probabilities ELSE c.start_probabilities END,
+            c.end_probabilities = CASE WHEN row.position_type = 2 THEN row.probabilities ELSE c.end_probabilities END
         RETURN count(*) AS updated
 """
 
@@ -115,18 +113,46 @@ def chunks(lst, size):
     for i in range(0, len(lst), size):
         yield lst[i:i + size]
 
-print("Updating Neo4j in batches")
-updates = grouped_df[["conversation_id", "position_type", "sentiment_expected_value"]].rename(
-    columns={
-        "conversation_id": "conv_id",
-        "position_type": "position_type",
-        "sentiment_expected_value": "sentiment"
-    }
-)
-batch_size = 1000
-
-with driver.session() as session:
-    for batch in tqdm(chunks(updates.to_dict("records"), batch_size), total=math.ceil(len(updates) / batch_size)):
-        session.execute_write(update_conversations_batch, batch)
-
-print(f"Done! Processed {len(grouped_df)} conversations in {round(time.time() - start_time, 2)} seconds.")
\ No newline at end of file
+def update_neo4j(grouped_df, batch_size=UPDATE_BATCH_SIZE):
+    from neo4j import GraphDatabase
+    driver = GraphDatabase.driver(uri, auth=(user, password), database="databaseconversation")
+
+    print("Updating Neo4j in batches")
+    updates = grouped_df[["conversation_id", "position_type", "sentiment_expected_value"]].rename(
+        columns={
+            "conversation_id": "conv_id",
+            "position_type": "position_type",
+            "sentiment_expected_value": "sentiment"
+        }
+    )
+    # [negative, neutral, positive]
+    updates["probabilities"] = grouped_df[["sentiment_negative", "sentiment_neutral", "sentiment_positive"]].values.tolist()
+
+    with driver.session() as session:
+        for batch in tqdm(chunks(updates.to_dict("records"), batch_size), total=math.ceil(len(updates) / batch_size)):
+            session.execute_write(update_conversations_batch, batch)
+    driver.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the start and end of every conversation and store it in Neo4j.")
+    parser.add_argument("--input", default=CSV_PATH)
+    parser.add_argument("--sentiment-replicas", type=int, default=0,
+                        help="score in a pool of this many model processes (0: in process)")
+    args = parser.parse_args()
+
+    grouped_df = load_conversation_texts(args.input)
+
+    start_time = time.time()
+    print("Starting sentiment analysis")
+    if args.sentiment_replicas:
+        with SentimentService(args.sentiment_replicas, max_clients=1) as service:
+            score_conversations(grouped_df, client=service.client())
+    else:
+        score_conversations(grouped_df)
+    grouped_df.drop(columns=["text", "clean_text"]).to_csv(SCORES_PATH, index=False)
+    update_neo4j(grouped_df)
+
+    print(f"Done! Processed {len(grouped_df)} conversations in {round(time.time() - start_time, 2)} seconds.")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,114 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch.nn.functional as F
+import os
+import queue
+import threading
+import numpy as np
+from sentiment_cache import cache_key, open_cache
+
+MAX_LENGTH = 128
+TOKEN_BUDGET = 64 * MAX_LENGTH  # padded tokens per forward pass, bounds peak memory
+PREFETCH_TEXTS = 1024  # texts tokenized and bucketed together
+PREFETCH_BATCHES = 2  # batches tokenized ahead of the model
 
-# Load pre-trained model and tokenizer from Hugging Face
 model_name = "cardiffnlp/twitter-roberta-base-sentiment-latest"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name)
 
-# Set device to GPU if available (otherwise use CPU)
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = model.to(device)
-model.eval()
+# torch runs the model as is, int8 quantizes its linear layers, onnx runs an exported graph in ONNX Runtime
+BACKENDS = ["torch", "int8", "onnx"]
+BACKEND = os.environ.get("SENTIMENT_BACKEND", "torch")
+ONNX_PATH = os.environ.get("SENTIMENT_ONNX_PATH", os.path.join("models", "twitter-roberta-sentiment.onnx"))
+
+class ModelOutput:
+    def __init__(self, logits):
+        self.logits = logits
+
+class OnnxModel:
+    """
+    ONNX Runtime session behind the call interface of the transformers model.
+    The graph is exported from the torch model on first use.
+    """
+    def __init__(self, torch_model, path=ONNX_PATH):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime (pip install onnxruntime)")
+        if not os.path.exists(path):
+            export_onnx(torch_model, path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.config = torch_model.config
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(["logits"], {
+            "input_ids": input_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy(),
+        })[0]
+        import torch
+        return ModelOutput(torch.from_numpy(logits))
+
+def export_onnx(torch_model, path=ONNX_PATH):
+    import torch
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    sample = get_tokenizer()(["export sample"], return_tensors="pt")
+    torch.onnx.export(
+        torch_model.cpu(), (sample["input_ids"], sample["attention_mask"]), path,
+        input_names=["input_ids", "attention_mask"], output_names=["logits"],
+        dynamic_axes={name: {0: "batch", 1: "sequence"} for name in ["input_ids", "attention_mask"]} | {"logits": {0: "batch"}},
+        opset_version=17,
+    )
+
+# torch, the tokenizer and the models are loaded on first use, not at import,
+# so scripts that only import this module (or only hit the cache) start fast
+_handles = {}
+_handles_lock = threading.RLock()  # reentrant, the onnx export needs the tokenizer while loading
+
+def get_tokenizer():
+    with _handles_lock:
+        if "tokenizer" not in _handles:
+            from transformers import AutoTokenizer
+            _handles["tokenizer"] = AutoTokenizer.from_pretrained(model_name)
+        return _handles["tokenizer"]
+
+def get_model(backend=BACKEND):
+    """
+    Shared (model, device) handle of a backend, loaded once per process.
+    """
+    with _handles_lock:
+        if backend not in _handles:
+            _handles[backend] = load_model(backend)
+        return _handles[backend]
+
+def warm_up(num_threads=None):
+    """
+    Load the tokenizer and model of this process ahead of its first batch, with torch
+    limited to num_threads threads if given. Worker and replica processes call this
+    instead of get_model, so a stand-in module only has to provide a no-op.
+    """
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    get_tokenizer()
+    get_model()
+
+def load_model(backend=BACKEND):
+    """
+    The sentiment model on the given backend. int8 and onnx always run on the CPU.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown sentiment backend {backend!r}, expected one of {BACKENDS}")
+    import torch
+    from transformers import AutoModelForSequenceClassification
+    torch_model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    torch_model.eval()
+    if backend == "int8":
+        return torch.quantization.quantize_dynamic(torch_model, {torch.nn.Linear}, dtype=torch.qint8), "cpu"
+    if backend == "onnx":
+        return OnnxModel(torch_model), "cpu"
+    # Set device to GPU if available (otherwise use CPU)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch_model.to(device), device
+
+# Cache entries are per backend, since quantized and exported models drift slightly from the reference
+model_id = model_name if BACKEND == "torch" else f"{model_name}:{BACKEND}"
 
 # Preprocessing tweets
 def preprocess(text):
@@ -18,31 +116,141 @@ def preprocess(text):
     words = ['@user' if w.startswith('@') else 'http' if w.startswith('http') else w for w in words]
     return " ".join(words)
 
+LABELS = ["negative", "neutral", "positive"]  # order of the cached probabilities
+
+_cache = None
+_cache_pid = None
+
+def get_cache():
+    # Opened per process, an SQLite connection must not cross a fork
+    global _cache, _cache_pid
+    if _cache_pid != os.getpid():
+        _cache = open_cache()
+        _cache_pid = os.getpid()
+    return _cache
+
+def summarize(probs):
+    """
+    Labels and expected values of an (n, 3) array of (negative, neutral, positive) probabilities.
+    """
+    probs = np.asarray(probs, dtype=np.float64).reshape(-1, len(LABELS))
+    labels = np.array(LABELS)[probs.argmax(axis=1)]
+    expected_values = np.round(probs[:, 2] - probs[:, 0], 4)
+    return labels, expected_values
+
 # Run sentiment analysis on a single tweet
 def get_sentiment(text):
-    text = preprocess(text)
-    encoded = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=128).to(device)
-    with torch.no_grad():
-        output = model(**encoded)
-        probs = F.softmax(output.logits, dim=1)[0]
-        prob_dict = {model.config.id2label[i]: probs[i].item() for i in range(len(probs))}
-        expected_value = round(prob_dict["positive"] - prob_dict["negative"], 4)
-        label = max(prob_dict, key=prob_dict.get)
-    return label, expected_value
-
-# Run sentiment analysis on a list of tweets
-def get_sentiment_batch(texts, batch_size=64):
-    preprocessed = [preprocess(text) for text in texts]
-    encoded = tokenizer(preprocessed, return_tensors="pt", truncation=True, padding=True, max_length=128).to(device)
-
-    with torch.no_grad():
-        outputs = model(**encoded)
-        probs = F.softmax(outputs.logits, dim=1)
-
-    results = []
-    for prob in probs:
-        prob_dict = {model.config.id2label[i]: prob[i].item() for i in range(len(prob))}
-        expected_value = round(prob_dict["positive"] - prob_dict["negative"], 4)
-        label = max(prob_dict, key=prob_dict.get)
-        results.append((label, expected_value))
+    return get_sentiment_batch([text])[0]
+
+def make_batches(lengths, batch_size=64, token_budget=TOKEN_BUDGET):
+    """
+    Group indices into batches of similar token length. Every batch holds at most
+    batch_size texts and at most token_budget tokens once padded to its longest text.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, batch = [], []
+    for i in order:
+        # Sorted ascending, so the text being added is the longest of its batch
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * lengths[i] > token_budget):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def prepare_batches(preprocessed, batch_size, token_budget, on_device):
+    """
+    Yields (indices, padded inputs) for every model batch. Texts are tokenized PREFETCH_TEXTS
+    at a time and bucketed by length within that window.
+    """
+    tokenizer = get_tokenizer()
+    for start in range(0, len(preprocessed), PREFETCH_TEXTS):
+        # Tokenized once without padding, each batch is padded only to its own longest text
+        encoded = tokenizer(preprocessed[start:start + PREFETCH_TEXTS], truncation=True, max_length=MAX_LENGTH)["input_ids"]
+        for batch in make_batches([len(ids) for ids in encoded], batch_size, token_budget):
+            padded = tokenizer.pad({"input_ids": [encoded[i] for i in batch]}, return_tensors="pt").to(on_device)
+            yield [start + i for i in batch], padded
+
+def prefetch(iterator, depth=PREFETCH_BATCHES):
+    """
+    Run iterator on a background thread, up to depth items ahead of the consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def run():
+        try:
+            for item in iterator:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def predict_probs(preprocessed, batch_size=64, token_budget=TOKEN_BUDGET, loaded=None):
+    """
+    Run the model over preprocessed texts, returns an (n, 3) array of (negative, neutral, positive).
+    loaded is a (model, device) pair from load_model(), the module's own backend by default.
+    The next batches are tokenized on a background thread while the model runs the current one.
+    """
+    import torch
+    import torch.nn.functional as F
+    net, on_device = loaded or get_model()
+    label_index = [net.config.label2id[label] for label in LABELS]
+
+    results = np.empty((len(preprocessed), len(LABELS)), dtype=np.float64)
+    for indices, padded in prefetch(prepare_batches(preprocessed, batch_size, token_budget, on_device)):
+        with torch.no_grad():
+            outputs = net(**padded)
+            probs = F.softmax(outputs.logits, dim=1)
+        results[indices] = probs[:, label_index].cpu().numpy()
     return results
+
+def sentiment_arrays(probs):
+    """
+    Columns of an (n, 3) probability array: negative, neutral, positive, label and expected_value.
+    """
+    probs = np.asarray(probs, dtype=np.float64).reshape(-1, len(LABELS))
+    labels, expected_values = summarize(probs)
+    arrays = {label: probs[:, i] for i, label in enumerate(LABELS)}
+    arrays["label"] = labels
+    arrays["expected_value"] = expected_values
+    return arrays
+
+def get_sentiment_probs(texts, batch_size=64, token_budget=TOKEN_BUDGET):
+    """
+    (n, 3) array of (negative, neutral, positive) probabilities, in the order of texts.
+    """
+    preprocessed = [preprocess(text) for text in texts]
+    # Identical texts (retweets mostly) are scored once, and only if they aren't cached yet
+    keys = [cache_key(model_id, text) for text in preprocessed]
+    unique = dict(zip(keys, preprocessed))
+    cache = get_cache()
+    known = cache.get_many(unique) if cache is not None else {}
+
+    missing = [key for key in unique if key not in known]
+    if missing:
+        computed = list(zip(missing, predict_probs([unique[key] for key in missing], batch_size, token_budget).tolist()))
+        if cache is not None:
+            cache.put_many(computed)
+        known.update(computed)
+    return np.array([known[key] for key in keys], dtype=np.float64).reshape(-1, len(LABELS))
+
+# Columnar sentiment of a list of tweets: a numpy array per column, rows in the order of texts.
+# Store the probabilities, so a new score definition doesn't need the model again
+def get_sentiment_arrays(texts, batch_size=64, token_budget=TOKEN_BUDGET):
+    return sentiment_arrays(get_sentiment_probs(texts, batch_size, token_budget))
+
+# Run sentiment analysis on a list of tweets, results are (label, expected_value) in the order of texts
+def get_sentiment_batch(texts, batch_size=64, token_budget=TOKEN_BUDGET):
+    arrays = get_sentiment_arrays(texts, batch_size, token_budget)
+    return list(zip(arrays["label"].tolist(), arrays["expected_value"].tolist()))
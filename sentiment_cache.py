@@ -0,0 +1,109 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_PATH = os.environ.get("SENTIMENT_CACHE", "sentiment_cache.sqlite")  # empty string turns the cache off
+MAX_ENTRIES = int(os.environ.get("SENTIMENT_CACHE_SIZE", 5_000_000))
+EVICT_FRACTION = 0.1  # share of the entries dropped when the cache is full
+
+def cache_key(model_name, text):
+    """
+    Content address of a preprocessed text under a model: identical texts share one entry,
+    a different model never reuses another model's scores.
+    """
+    return hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+class SentimentCache:
+    """
+    Persistent sentiment scores in SQLite, keyed by cache_key. Stores the class probabilities
+    (negative, neutral, positive) and evicts the least recently used entries beyond max_entries.
+    Safe to share between threads, and between processes through SQLite's own locking.
+    """
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sentiment (
+                key BLOB PRIMARY KEY,
+                negative REAL, neutral REAL, positive REAL,
+                last_used INTEGER
+            ) WITHOUT ROWID""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sentiment_last_used ON sentiment (last_used)")
+        self.conn.commit()
+        # Estimated entry count, recounted only when it passes max_entries
+        self.count = self.conn.execute("SELECT count(*) FROM sentiment").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Returns {key: (negative, neutral, positive)} for the keys that are cached.
+        """
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, negative, neutral, positive FROM sentiment WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update((row[0], row[1:]) for row in rows)
+            if found:
+                now = int(time.time())
+                self.conn.executemany("UPDATE sentiment SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        items: list of (key, (negative, neutral, positive)) pairs.
+        """
+        now = int(time.time())
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sentiment VALUES (?, ?, ?, ?, ?)",
+                [(key, *probs, now) for key, probs in items],
+            )
+            self.conn.commit()
+            self.count += len(items)
+            if self.count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        count = self.conn.execute("SELECT count(*) FROM sentiment").fetchone()[0]
+        self.count = count
+        if count <= self.max_entries:
+            return
+        # Drop a slice at once, so a full cache doesn't evict on every insert
+        excess = count - self.max_entries + int(self.max_entries * EVICT_FRACTION)
+        self.conn.execute(
+            "DELETE FROM sentiment WHERE key IN (SELECT key FROM sentiment ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self.conn.commit()
+        self.count -= excess
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM sentiment").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def open_cache(path=CACHE_PATH, max_entries=MAX_ENTRIES):
+    """
+    Returns a SentimentCache, or None when caching is turned off with an empty path.
+    """
+    if not path:
+        return None
+    return SentimentCache(path, max_entries)
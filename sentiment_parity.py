@@ -0,0 +1,57 @@
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from roberta_sentiment import BACKENDS, load_model, predict_probs, preprocess, summarize
+
+def run_backend(backend, texts, batch_size):
+    loaded = load_model(backend)
+    start = time.perf_counter()
+    probs = predict_probs(texts, batch_size, loaded=loaded)
+    elapsed = time.perf_counter() - start
+    return summarize(probs), elapsed
+
+def parity(texts, backend, batch_size=64, reference="torch"):
+    """
+    Score texts on the reference backend and on backend and compare the two:
+    label agreement, expected-value drift and throughput of each.
+    """
+    texts = [preprocess(text) for text in texts]
+    expected, reference_seconds = run_backend(reference, texts, batch_size)
+    actual, backend_seconds = run_backend(backend, texts, batch_size)
+
+    drift = np.abs(actual[1] - expected[1])
+    return {
+        "texts": len(texts),
+        "label_agreement": float(np.mean(actual[0] == expected[0])),
+        "mean_drift": float(drift.mean()),
+        "p99_drift": float(np.percentile(drift, 99)),
+        "max_drift": float(drift.max()),
+        "reference_texts_per_s": len(texts) / reference_seconds,
+        "backend_texts_per_s": len(texts) / backend_seconds,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a sentiment backend against the full-precision torch model.")
+    parser.add_argument("--backend", choices=BACKENDS, default="int8")
+    parser.add_argument("--input", default="import/tweets.csv", help="CSV with the texts to score")
+    parser.add_argument("--column", default="text")
+    parser.add_argument("--sample", type=int, default=2000, help="number of texts to compare")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="fail below this label agreement")
+    parser.add_argument("--max-drift", type=float, default=0.05, help="fail above this mean expected-value drift")
+    args = parser.parse_args()
+
+    texts = pd.read_csv(args.input, usecols=[args.column])[args.column].dropna().astype(str)
+    texts = texts.sample(min(args.sample, len(texts)), random_state=0).tolist()
+    report = parity(texts, args.backend, args.batch_size)
+
+    print(f"{args.backend} vs torch on {report['texts']} texts")
+    print(f"  label agreement      {report['label_agreement']:.2%}")
+    print(f"  expected value drift mean {report['mean_drift']:.4f}, p99 {report['p99_drift']:.4f}, max {report['max_drift']:.4f}")
+    print(f"  throughput           {report['backend_texts_per_s']:.1f} texts/s vs {report['reference_texts_per_s']:.1f} "
+          f"({report['backend_texts_per_s'] / report['reference_texts_per_s']:.1f}x)")
+    if report["label_agreement"] < args.min_agreement or report["mean_drift"] > args.max_drift:
+        print("Parity check failed")
+        sys.exit(1)
@@ -0,0 +1,206 @@
+import os
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.connection
+from collections import deque
+
+REPLICAS = max(1, (os.cpu_count() or 1) // 4)  # model copies, each running on its share of the cores
+MAX_CLIENTS = 64  # response queues allocated up front, one per client
+MAX_TEXTS = 256  # texts a replica collects from concurrent requests before running them
+MAX_WAIT = 0.01  # seconds a replica waits for more requests to fill a batch
+MAX_IN_FLIGHT = 4  # requests a client keeps queued in map_batches
+POLL_INTERVAL = 1.0  # seconds between liveness checks while waiting on the replicas
+
+def _replica_main(requests, responses, ready, num_threads, max_texts, max_wait):
+    """
+    Replica process: loads the model once, reports to ready (None or the traceback of
+    the failure), then serves requests until it gets None.
+    Requests of several clients are run as one batch and the results split up again.
+    """
+    try:
+        from roberta_sentiment import get_sentiment_arrays, warm_up
+        warm_up(num_threads)
+    except Exception:
+        ready.put(traceback.format_exc())
+        return
+    ready.put(None)
+
+    running = True
+    while running:
+        item = requests.get()
+        if item is None:
+            break
+        pending = [item]
+        size = len(item[2])
+        deadline = time.perf_counter() + max_wait
+        while size < max_texts:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                running = False
+                break
+            pending.append(item)
+            size += len(item[2])
+
+        texts = [text for _, _, batch in pending for text in batch]
+        try:
+            arrays = get_sentiment_arrays(texts)
+        except Exception as e:
+            for slot, request_id, _ in pending:
+                responses[slot].put((request_id, e))
+            continue
+        offset = 0
+        for slot, request_id, batch in pending:
+            responses[slot].put((request_id, {name: column[offset:offset + len(batch)] for name, column in arrays.items()}))
+            offset += len(batch)
+
+class SentimentClient:
+    """
+    Handle of one client slot. Can be passed to a child process when it is created,
+    e.g. through a ProcessPoolExecutor initializer. A client belongs to a single thread.
+    """
+    def __init__(self, slot, requests, responses, failed):
+        self.slot = slot
+        self.requests = requests
+        self.responses = responses
+        self.failed = failed
+        self.next_id = 0
+        self.done = {}
+
+    def submit(self, texts):
+        """
+        Queue texts for scoring and return a request id for result().
+        """
+        request_id = self.next_id
+        self.next_id += 1
+        self.requests.put((self.slot, request_id, list(texts)))
+        return request_id
+
+    def result(self, request_id):
+        """
+        The column arrays of a submitted request.
+        """
+        # Replicas answer in any order, answers to other requests are kept for later
+        while request_id not in self.done:
+            try:
+                rid, results = self.responses.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A replica that died may have taken this request with it
+                if self.failed.is_set():
+                    raise RuntimeError("A sentiment replica exited unexpectedly, its requests are lost")
+                continue
+            self.done[rid] = results
+        results = self.done.pop(request_id)
+        if isinstance(results, Exception):
+            raise results
+        return results
+
+    def get_sentiment_arrays(self, texts):
+        """
+        Same columns as roberta_sentiment.get_sentiment_arrays.
+        """
+        return self.result(self.submit(texts))
+
+    def get_sentiment_batch(self, texts):
+        arrays = self.get_sentiment_arrays(texts)
+        return list(zip(arrays["label"].tolist(), arrays["expected_value"].tolist()))
+
+    def map_batches(self, batches, max_in_flight=MAX_IN_FLIGHT):
+        """
+        Score an iterable of text batches with up to max_in_flight requests queued,
+        so several replicas work for this client. Yields the column arrays of each batch in order.
+        """
+        in_flight = deque()
+        for texts in batches:
+            in_flight.append(self.submit(texts))
+            if len(in_flight) >= max_in_flight:
+                yield self.result(in_flight.popleft())
+        while in_flight:
+            yield self.result(in_flight.popleft())
+
+class SentimentService:
+    """
+    Local inference pool: replicas model processes that share one request queue.
+    Every client has its own preallocated response queue, so clients in other
+    processes can be handed a slot without any further setup.
+    Returns once every replica has loaded the model and raises if one fails to.
+    Clients raise instead of waiting forever if a replica dies later on.
+    """
+    def __init__(self, replicas=REPLICAS, max_clients=MAX_CLIENTS, threads_per_replica=None,
+                 max_texts=MAX_TEXTS, max_wait=MAX_WAIT):
+        context = multiprocessing.get_context()
+        self.requests = context.Queue()
+        self.responses = [context.Queue() for _ in range(max_clients)]
+        self.failed = context.Event()
+        self.closing = False
+        ready = context.Queue()
+        threads = threads_per_replica or max(1, (os.cpu_count() or 1) // replicas)
+        self.replicas = [
+            context.Process(target=_replica_main,
+                            args=(self.requests, self.responses, ready, threads, max_texts, max_wait), daemon=True)
+            for _ in range(replicas)
+        ]
+        for replica in self.replicas:
+            replica.start()
+        self.wait_ready(ready)
+        threading.Thread(target=self.monitor, daemon=True).start()
+        self.next_slot = 0
+
+    def wait_ready(self, ready):
+        loaded = 0
+        while loaded < len(self.replicas):
+            try:
+                error = ready.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                exited = [replica.exitcode for replica in self.replicas if replica.exitcode is not None]
+                if exited:
+                    self.terminate()
+                    raise RuntimeError(f"A sentiment replica exited with code {exited[0]} while loading the model")
+                continue
+            if error is not None:
+                self.terminate()
+                raise RuntimeError(f"A sentiment replica failed to load the model:\n{error}")
+            loaded += 1
+
+    def monitor(self):
+        # Any replica exiting before close() fails the clients, requests it held are lost
+        multiprocessing.connection.wait([replica.sentinel for replica in self.replicas])
+        if not self.closing:
+            self.failed.set()
+
+    def terminate(self):
+        for replica in self.replicas:
+            if replica.is_alive():
+                replica.terminate()
+            replica.join()
+
+    def client(self):
+        if self.next_slot >= len(self.responses):
+            raise RuntimeError(f"All {len(self.responses)} client slots are taken, raise max_clients")
+        client = SentimentClient(self.next_slot, self.requests, self.responses[self.next_slot], self.failed)
+        self.next_slot += 1
+        return client
+
+    def close(self):
+        self.closing = True
+        if self.failed.is_set():
+            self.terminate()
+            return
+        for _ in self.replicas:
+            self.requests.put(None)
+        for replica in self.replicas:
+            replica.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
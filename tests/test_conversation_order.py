@@ -0,0 +1,120 @@
+import random
+import sys
+
+import pytest
+
+from conversation_order import MISSING_TIME, build_adjacency, order_component, tweet_time
+
+N_DEEP = 300_000
+
+def recursive_order(tweet_list, children_map):
+    # The recursive dfs building_conversations.py used before conversation_order.py
+    all_children = {c for clist in children_map.values() for c in clist}
+
+    def dfs(node, visited, result):
+        if node in visited:
+            return
+        visited.add(node)
+        for child in children_map.get(node, []):
+            dfs(child, visited, result)
+        result.append(node)
+
+    visited, ordered = set(), []
+    for root in tweet_list:
+        if root not in all_children:
+            dfs(root, visited, ordered)
+    return list(reversed(ordered))
+
+def random_graph(rng):
+    n = rng.randint(1, 30)
+    tweet_ids = [f"t{i}" for i in range(n)]
+    rng.shuffle(tweet_ids)
+    # Parents and children may lie outside tweet_list, and edges may form cycles
+    outside_parents, outside_children = ["x1", "x2"], ["x3", "x4"]
+    children_map = {}
+    for _ in range(rng.randint(0, 2 * n)):
+        parent = rng.choice(tweet_ids + outside_parents)
+        child = rng.choice(tweet_ids + outside_children)
+        children = children_map.setdefault(parent, [])
+        if child not in children:
+            children.append(child)
+    if rng.random() < 0.2:
+        tweet_ids = tweet_ids[:rng.randint(1, n)]
+    return tweet_ids, children_map
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_recursive_dfs(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        tweet_list, children_map = random_graph(rng)
+        assert order_component(tweet_list, children_map) == recursive_order(tweet_list, children_map)
+
+def test_cycle_without_root_is_empty():
+    assert order_component(["a", "b"], {"a": ["b"], "b": ["a"]}) == []
+
+def test_children_outside_tweet_list_are_included():
+    assert order_component(["a"], {"a": ["b"], "b": ["c"]}) == ["a", "b", "c"]
+
+def test_adjacency_is_compact():
+    nodes, offsets, targets = build_adjacency(["a", "b", "c"], {"a": ["b", "c"], "c": ["d"]})
+    assert nodes == ["a", "b", "c", "d"]
+    assert offsets == [0, 2, 2, 3, 3]
+    assert targets == [1, 2, 3]
+
+def test_deep_chain():
+    tweet_list = [f"t{i}" for i in range(N_DEEP)]
+    children_map = {tweet_list[i]: [tweet_list[i + 1]] for i in range(N_DEEP - 1)}
+    assert N_DEEP > sys.getrecursionlimit()
+    assert order_component(tweet_list, children_map) == tweet_list
+
+def test_deep_chain_listed_backwards():
+    tweet_list = [f"t{i}" for i in range(N_DEEP)]
+    children_map = {tweet_list[i]: [tweet_list[i + 1]] for i in range(N_DEEP - 1)}
+    assert order_component(tweet_list[::-1], children_map) == tweet_list
+
+def test_wide_fan_out():
+    replies = [f"t{i}" for i in range(N_DEEP)]
+    ordered = order_component(["root"] + replies, {"root": replies})
+    # Reversed post-order lists the replies in reverse of their children_map order
+    assert ordered == ["root"] + replies[::-1]
+
+def test_wide_fan_out_chronological():
+    replies = [f"t{i}" for i in range(N_DEEP)]
+    times = {tid: i for i, tid in enumerate(replies)}
+    times["root"] = -1
+    shuffled = replies[:]
+    random.Random(0).shuffle(shuffled)
+    ordered = order_component(["root"] + shuffled, {"root": shuffled}, key=times.get)
+    assert ordered == ["root"] + replies
+
+def test_tweet_time():
+    assert tweet_time("Wed May 22 00:00:05 +0000 2019").second == 5
+    assert tweet_time("") == MISSING_TIME
+    assert tweet_time(None) == MISSING_TIME
+
+def test_chronological_order():
+    created_at = {
+        "a": "Wed May 22 00:00:05 +0000 2019",
+        "b": "Wed May 22 00:00:09 +0000 2019",
+        "c": "Wed May 22 00:00:07 +0000 2019",
+        "d": "Wed May 22 00:00:01 +0000 2019",
+        "e": "Wed May 22 00:00:08 +0000 2019",
+    }
+    key = lambda tid: tweet_time(created_at.get(tid))
+    # Two roots, d the earlier one; a's replies b and c, listed latest first
+    ordered = order_component(["a", "b", "c", "d", "e"], {"a": ["b", "c"], "d": ["e"]}, key=key)
+    assert ordered == ["d", "e", "a", "c", "b"]
+
+def test_chronological_missing_created_at_sorts_first():
+    created_at = {"a": "Wed May 22 00:00:05 +0000 2019", "b": "Wed May 22 00:00:06 +0000 2019"}
+    key = lambda tid: tweet_time(created_at.get(tid))
+    ordered = order_component(["r", "a", "b"], {"r": ["b", "a", "x"]}, key=key)
+    assert ordered == ["r", "x", "a", "b"]
+    # Roots without a created_at come before the dated ones
+    assert order_component(["a", "y"], {}, key=key) == ["y", "a"]
+
+def test_chronological_ties_keep_a_consistent_order():
+    key = lambda tid: 0
+    tweet_list = ["a", "b", "c"]
+    assert sorted(order_component(tweet_list, {"a": ["b", "c"]}, key=key)) == tweet_list
+    assert order_component(tweet_list, {"a": ["b", "c"]}, key=key)[0] == "a"
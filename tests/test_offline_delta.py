@@ -0,0 +1,95 @@
+import os
+import csv
+
+import pytest
+
+from airlines import airline_ids
+from conversation_state import INPUT_FILES
+from ingest_state import save_manifest
+from offline_conversations import build, delta, export
+
+AIRLINE = airline_ids[0]
+
+def created_at(second):
+    return f"Wed May 22 00:00:{second:02d} +0000 2019"
+
+def write_csv(path, rows, header=None):
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+def write_import(import_dir, tweets, posted, replies, header=False):
+    write_csv(import_dir / "tweets.csv", [["Tweet", tid, "text", created_at(int(tid))] for tid in tweets],
+              [":LABEL", "tweetId:ID(Tweet)", "text", "created_at"] if header else None)
+    write_csv(import_dir / "posted.csv", [[airline, tid, "POSTED"] for airline, tid in posted],
+              [":START_ID(User)", ":END_ID(Tweet)", ":TYPE"] if header else None)
+    write_csv(import_dir / "replies.csv", [[child, parent, "REPLIES"] for child, parent in replies],
+              [":START_ID(Tweet)", ":END_ID(Tweet)", ":TYPE"] if header else None)
+
+def read_conversations(output_dir):
+    with open(output_dir / "conversations.csv", newline="", encoding="utf-8") as f:
+        conversations = {row[1]: row[2:] for row in list(csv.reader(f))[1:]}
+    edges = {}
+    with open(output_dir / "conversation_edges.csv", newline="", encoding="utf-8") as f:
+        for conv_id, tid, _, position_type in list(csv.reader(f))[1:]:
+            edges.setdefault(conv_id, []).append((tid, position_type))
+    return sorted((tuple(conversations[conv_id]), tuple(tweets)) for conv_id, tweets in edges.items())
+
+def read_changes(output_dir, run):
+    with open(output_dir / "conversation_changes" / f"{run:04d}_conversations.csv", newline="", encoding="utf-8") as f:
+        return {row[1]: row[-1] for row in list(csv.reader(f))[1:]}
+
+def test_delta_matches_a_full_build(tmp_path):
+    import_dir = tmp_path / "import"
+    import_dir.mkdir()
+    # Two conversations of the airline: 1 <- 2 <- 3 and 4 <- 5 <- 6, and one of another user
+    write_import(import_dir, ["1", "2", "3", "4", "5", "6", "10", "11", "12"],
+                 [(AIRLINE, "2"), (AIRLINE, "5"), ("9", "1")],
+                 [("2", "1"), ("3", "2"), ("5", "4"), ("6", "5"), ("11", "10"), ("12", "11")], header=True)
+    assert build(import_dir, import_dir) == 2
+
+    # 4 replies into the first conversation and merges both, a new conversation starts at 20
+    write_import(import_dir, ["7", "20", "21", "22"], [(AIRLINE, "21")],
+                 [("4", "3"), ("7", "6"), ("21", "20"), ("22", "21")])
+    assert delta(import_dir, import_dir) == {"added": 1, "changed": 1, "removed": 1}
+    assert read_changes(import_dir, 1) == {"c1": "changed", "c2": "removed", "c3": "added"}
+
+    # Nothing new, nothing changes
+    assert delta(import_dir, import_dir) == {"added": 0, "changed": 0, "removed": 0}
+
+    assert export(import_dir) == 2
+    rebuild_dir = tmp_path / "rebuild"
+    build(import_dir, rebuild_dir)
+    assert read_conversations(import_dir) == read_conversations(rebuild_dir)
+
+def test_delta_leaves_untouched_conversations_out(tmp_path):
+    import_dir = tmp_path / "import"
+    import_dir.mkdir()
+    write_import(import_dir, ["1", "2", "3", "4", "5", "6"], [(AIRLINE, "2"), (AIRLINE, "5")],
+                 [("2", "1"), ("3", "2"), ("5", "4"), ("6", "5")], header=True)
+    build(import_dir, import_dir)
+
+    # An edge seen before and a thread without the airline touch c1 without changing it
+    write_import(import_dir, ["7", "8"], [], [("3", "2"), ("8", "7")])
+    assert delta(import_dir, import_dir) == {"added": 0, "changed": 0, "removed": 0}
+    assert read_changes(import_dir, 1) == {}
+
+def test_delta_waits_for_the_ingest_checkpoint(tmp_path):
+    import_dir = tmp_path / "import"
+    import_dir.mkdir()
+    write_import(import_dir, ["1", "2", "3"], [(AIRLINE, "2")], [("2", "1"), ("3", "2")], header=True)
+    offsets = {name: os.path.getsize(import_dir / name) for name in INPUT_FILES}
+    save_manifest(str(import_dir), {"files": {}, "offsets": offsets})
+    assert build(import_dir, import_dir) == 1
+
+    # Rows to_csv.py has written but not checkpointed yet, e.g. of a crashed run it will roll back
+    write_import(import_dir, ["4"], [], [("4", "3")])
+    with pytest.raises(RuntimeError, match="ingest checkpoint"):
+        delta(import_dir, import_dir)
+
+    # Once checkpointed they are picked up
+    offsets = {name: os.path.getsize(import_dir / name) for name in INPUT_FILES}
+    save_manifest(str(import_dir), {"files": {}, "offsets": offsets})
+    assert delta(import_dir, import_dir) == {"added": 0, "changed": 1, "removed": 0}
@@ -1,30 +1,81 @@
+import argparse
 import threading
 import queue
 import os
+import re
 import json
 import csv
-from roberta_sentiment import get_sentiment_batch
+import shutil
+import time
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dedup import ShardedSet, TweetIndex
+from ingest_metrics import Metrics
+from ingest_state import (ID_LOGS, PENDING_LOG, STATE_DIRNAME, IngestCheckpoint, discard_compacted_pending, is_processed,
+                          load_dedup_state, load_manifest, rollback_outputs, state_dir)
+from parquet_output import close_sinks, open_sinks
+from sentiment_service import MAX_IN_FLIGHT, SentimentService
+from tweet_readers import CHUNK_SIZE, iter_lines, list_input_files, make_tasks
 
 NUM_PRODUCERS = 6
+NUM_WORKERS = os.cpu_count() or 1  # process mode, one worker per core
 BATCH_SIZE = 64
+SCORE_SENTIMENT = True  # False with --no-sentiment, backfill_sentiment.py scores the tweets later
+COLLAPSE_RETWEETS = False  # True with --collapse-retweets, retweets become RETWEETED edges to the original tweet
+BATCH_TIMEOUT = 0.05  # seconds the inference stage waits before running a partial batch
+ROW_BATCH_SIZE = 512  # output rows a producer collects before handing them to the writer
+WRITE_BUFFER = 8 * 1024 * 1024  # bytes buffered per output file
 
 DATA_DIR = "data"
 OUTPUT_DIR = "import"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+SHARD_DIR = os.path.join(OUTPUT_DIR, "shards")
 
-files = [os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.endswith(".json")]
-file_chunks = [files[i::NUM_PRODUCERS] for i in range(NUM_PRODUCERS)]
+USERS_HEADER = [":LABEL", "userId:ID(User)", "name", "screen_name", "followers", "verified"]
+TWEETS_HEADER = [":LABEL", "tweetId:ID(Tweet)", "text", "created_at", "lang", "Type", "sentiment_label", "sentiment_expected_value",
+                 "sentiment_negative", "sentiment_neutral", "sentiment_positive"]
+POSTED_HEADER = [":START_ID(User)", ":END_ID(Tweet)", ":TYPE"]
+REPLIES_HEADER = [":START_ID(Tweet)", ":END_ID(Tweet)", ":TYPE"]
+RETWEETED_HEADER = [":START_ID(User)", ":END_ID(Tweet)", "created_at", ":TYPE"]  # only filled with --collapse-retweets
+OUTPUT_HEADERS = {"users.csv": USERS_HEADER, "tweets.csv": TWEETS_HEADER, "posted.csv": POSTED_HEADER, "replies.csv": REPLIES_HEADER,
+                  "retweeted.csv": RETWEETED_HEADER}
 
-data_queue = queue.Queue(maxsize=1000)  # buffer size, tune as needed
+data_queue = queue.Queue(maxsize=64)  # batches of output rows, tune as needed
+tweet_queue = queue.Queue(maxsize=4 * NUM_PRODUCERS)  # batches of parsed tweets waiting for inference
 stop_signal = object()  # special object to signal consumer to stop
 
-# Shared sets for deduplication
-user_ids = set()
-tweet_ids = set()
-posted_edges = set()
-reply_edges = set()
+# Shared sets for deduplication, hash-partitioned so producers don't contend on one lock
+user_ids = ShardedSet()
+tweet_ids = TweetIndex()  # also holds the replies waiting for their parent tweet
+posted_edges = ShardedSet()
+reply_edges = ShardedSet()
+retweet_edges = ShardedSet()
 screen_name_to_id = {}
-lock = threading.Lock()
+
+metrics = Metrics()
+sentiment_clients = None  # process mode with --sentiment-replicas, one service client per worker
+progress_queue = None  # process mode, workers send their counters and timings after every task
+
+def open_outputs(append):
+    """
+    Open the import CSVs and the node id logs, keyed by their path relative to OUTPUT_DIR.
+    A full run truncates them and writes the headers, an incremental run appends.
+    """
+    handles = {}
+    for name, header in OUTPUT_HEADERS.items():
+        handles[name] = open(os.path.join(OUTPUT_DIR, name), "a" if append else "w", newline="", encoding="utf-8",
+                             buffering=WRITE_BUFFER)
+        # An incremental run can meet an output file that earlier runs didn't have yet
+        if handles[name].tell() == 0:
+            csv.writer(handles[name]).writerow(header)
+    os.makedirs(state_dir(OUTPUT_DIR), exist_ok=True)
+    if not append:
+        discard_compacted_pending(OUTPUT_DIR)
+    for log_name in list(ID_LOGS.values()) + [PENDING_LOG]:
+        handles[os.path.join(STATE_DIRNAME, log_name)] = open(
+            os.path.join(state_dir(OUTPUT_DIR), log_name), "a" if append else "w", encoding="utf-8",
+            buffering=WRITE_BUFFER)
+    return handles
 
 def get_full_text(tweet):
     if "retweeted_status" in tweet:
@@ -46,170 +97,775 @@ def classify_tweet_type(tweet):
         return 4
     return 1
 
-def producer(files_subset):
+class RowBuffer:
+    """
+    Collects a producer's output rows per kind and hands them to the writer in
+    batches, so a queue handoff is paid per ROW_BATCH_SIZE rows instead of per row.
+    """
+    def __init__(self, size=ROW_BATCH_SIZE):
+        self.size = size
+        self.rows = defaultdict(list)
+        self.count = 0
+        self.blocked = 0.0  # seconds spent waiting on a full data_queue
+
+    def add(self, kind, row):
+        self.rows[kind].append(row)
+        self.count += 1
+        if self.count >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.count:
+            start = time.perf_counter()
+            data_queue.put(("rows", self.rows))
+            self.blocked += time.perf_counter() - start
+            self.rows = defaultdict(list)
+            self.count = 0
+
+def producer(tasks, producer_id=0):
+    rows = RowBuffer()
     tweet_batch = []
-    def flush_batch(batch):
-        texts = [entry["text"] for entry in batch]
-        sentiments = get_sentiment_batch(texts)
-        for entry, (label, expected_value) in zip(batch, sentiments):
-            data_queue.put(("tweet", {
-                "tid": entry["tid"],
-                "text": entry["text"],
-                "created_at": entry["created_at"],
-                "lang": entry["lang"],
-                "type": entry["type"],
-                "sentiment_label": label,
-                "sentiment_expected_value": expected_value,
-            }))
-        batch.clear()
-
-    for file_path in files_subset:
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    tweet = json.loads(line)
-                    if "delete" in tweet:
-                        continue
-                    if tweet.get("lang") != "en":
-                        continue
-                    created_at_str = tweet.get("created_at")
-                    if not created_at_str:
-                        continue
-
-                    user = tweet.get("user", {})
-                    uid = user.get("id_str")
-                    tid = tweet.get("id_str")
-                    if not uid or not tid:
-                        continue
-
-                    # Write users & user mentions with deduplication (lock protected)
-                    with lock:
-                        if uid not in user_ids:
-                            data_queue.put(("user", {
-                                "uid": uid,
-                                "name": user.get("name", ""),
-                                "screen_name": user.get("screen_name", ""),
-                                "followers_count": user.get("followers_count", ""),
-                                "verified": 1 if user.get("verified") else 0
-                            }))
-                            user_ids.add(uid)
-                            screen_name_to_id[user.get("screen_name", "")] = uid
-
-                        screen_name = user.get("screen_name", "")
-                        if screen_name and screen_name not in screen_name_to_id:
-                            screen_name_to_id[screen_name] = uid
-                        """
-                        for mention in tweet.get("entities", {}).get("user_mentions", []):
-                            mention_id = mention.get("id_str")
-                            mention_sn = mention.get("screen_name")
-                            if mention_id and mention_sn:
-                                if mention_id not in user_ids:
-                                    data_queue.put(("user", {
-                                        "uid": mention_id,
-                                        "name": "",
-                                        "screen_name": mention_sn,
-                                        "followers_count": "",
-                                        "verified": 0
-                                    }))
-                                    user_ids.add(mention_id)
-                                if mention_sn not in screen_name_to_id:
-                                    screen_name_to_id[mention_sn] = mention_id
-                        """
-
-                    # Collect tweets in batch
-                    with lock:
-                        if tid not in tweet_ids:
-                            tweet_type = classify_tweet_type(tweet)
-                            text = get_full_text(tweet)
-                            tweet_batch.append({
-                                "tid": tid,
-                                "text": text,
-                                "created_at": created_at_str,
-                                "lang": tweet.get("lang", ""),
-                                "type": tweet_type
-                            })
-                            tweet_ids.add(tid)
-
-                    # Flush batch if big enough
+    blocked = 0.0  # seconds spent waiting on a full tweet_queue
+    for task in tasks:
+        task_start = time.perf_counter()
+        blocked_before = blocked + rows.blocked
+        lines = kept = 0
+        for line in iter_lines(*task):
+            lines += 1
+            try:
+                parsed = parse_tweet(line)
+                if parsed is None:
+                    continue
+                user_row, tweet_record, replied_tid, retweet = parsed
+                uid, tid = user_row[1], tweet_record["tid"]
+                kept += 1
+
+                # Queue puts may block, so they only happen after the dedup check has released its shard lock
+                if user_ids.add(uid):
+                    rows.add("user", user_row)
+                    screen_name_to_id[user_row[3]] = uid
+                elif user_row[3]:
+                    screen_name_to_id.setdefault(user_row[3], uid)
+
+                # New tweets go to the inference stage, along with any replies that were waiting for them
+                is_new_tweet, waiting_replies = tweet_ids.add_tweet(tid)
+                if is_new_tweet:
+                    tweet_batch.append(tweet_record)
                     if len(tweet_batch) >= BATCH_SIZE:
-                        flush_batch(tweet_batch)
+                        put_start = time.perf_counter()
+                        tweet_queue.put(tweet_batch)
+                        blocked += time.perf_counter() - put_start
+                        tweet_batch = []
+                    for child in waiting_replies:
+                        if reply_edges.add((child, tid)):
+                            rows.add("replies", [child, tid, "REPLIES"])
 
-                    # POSTED edge
-                    with lock:
-                        posted = (uid, tid)
-                        if posted not in posted_edges:
-                            data_queue.put(("posted", (uid, tid)))
-                            posted_edges.add(posted)
-
-                    # REPLIES edge
-                    replied_tid = tweet.get("in_reply_to_status_id_str")
-                    with lock:
-                        if tid and replied_tid and tid in tweet_ids and replied_tid in tweet_ids:
-                            edge = (tid, replied_tid)
-                            if edge not in reply_edges:
-                                data_queue.put(("replies", edge))
-                                reply_edges.add(edge)
+                # POSTED edge
+                if posted_edges.add((uid, tid)):
+                    rows.add("posted", [uid, tid, "POSTED"])
 
-                except Exception:
-                    continue
+                # REPLIES edge, parked until the parent shows up if it hasn't been read yet
+                if is_new_tweet and replied_tid:
+                    if tweet_ids.link(tid, replied_tid):
+                        if reply_edges.add((tid, replied_tid)):
+                            rows.add("replies", [tid, replied_tid, "REPLIES"])
+                    else:
+                        rows.add("parked", f"{tid},{replied_tid}\n")
+
+                # RETWEETED edge from the retweeting user to the original, which was written above
+                if retweet is not None:
+                    retweeter_row, retweeted_at = retweet
+                    if user_ids.add(retweeter_row[1]):
+                        rows.add("user", retweeter_row)
+                        screen_name_to_id[retweeter_row[3]] = retweeter_row[1]
+                    if retweet_edges.add((retweeter_row[1], tid)):
+                        rows.add("retweeted", [retweeter_row[1], tid, retweeted_at, "RETWEETED"])
+
+            except Exception:
+                continue
+
+        # The task marker travels behind this task's rows and tweets, so the consumer knows when all of them are written
+        rows.flush()
+        if tweet_batch:
+            tweet_queue.put(tweet_batch)
+            tweet_batch = []
+        tweet_queue.put(("task_done", task))
+
+        task_blocked = blocked + rows.blocked - blocked_before
+        metrics.add_time("parse", time.perf_counter() - task_start - task_blocked)
+        metrics.add_time("producer_blocked", task_blocked)
+        metrics.incr("lines_read", lines)
+        metrics.incr("tweets_kept", kept)
+        metrics.incr(f"producer_{producer_id}_lines", lines)
+
+def parquet_row(kind, row):
+    # Same rows as the CSVs, minus the neo4j-admin label and type columns
+    if kind in ("user", "tweet"):
+        return row[1:]
+    return row[:-1]
+
+def sentiment_columns(arrays):
+    """
+    Per tweet the sentiment columns of TWEETS_HEADER: label, expected value and the class probabilities.
+    """
+    probabilities = [arrays[name].round(6).tolist() for name in ("negative", "neutral", "positive")]
+    return [list(row) for row in zip(arrays["label"].tolist(), arrays["expected_value"].tolist(), *probabilities)]
+
+def score_texts(texts, client=None):
+    if not SCORE_SENTIMENT:
+        return [["", "", "", "", ""]] * len(texts)
+    if client is not None:
+        return sentiment_columns(client.get_sentiment_arrays(texts))
+    # Imported on first use, so --no-sentiment runs never load torch
+    from roberta_sentiment import get_sentiment_arrays
+    return sentiment_columns(get_sentiment_arrays(texts))
+
+def inference_stage(client=None):
+    """
+    Single owner of the sentiment model. Builds batches from the tweets of all
+    producers and forwards the scored tweets to the consumer. A partial batch is
+    flushed when no new tweet arrives within BATCH_TIMEOUT seconds.
+    With a sentiment service client, up to MAX_IN_FLIGHT batches are scored at once.
+    """
+    batch = []
+    in_flight = deque()  # (entries, request id) submitted to the sentiment service
+
+    def emit(entries, sentiments):
+        metrics.incr("tweets_scored", len(entries))
+        metrics.incr("inference_batches")
+        with metrics.timer("inference_blocked"):
+            data_queue.put(("rows", {"tweet": [
+                ["Tweet", entry["tid"], entry["text"], entry["created_at"], entry["lang"], entry["type"], *columns]
+                for entry, columns in zip(entries, sentiments)
+            ]}))
+
+    def collect(limit=0):
+        while len(in_flight) > limit:
+            entries, request_id = in_flight.popleft()
+            with metrics.timer("inference"):
+                sentiments = sentiment_columns(client.result(request_id))
+            emit(entries, sentiments)
+
+    def flush_batch(entries):
+        if client is not None and SCORE_SENTIMENT:
+            in_flight.append((entries, client.submit([entry["text"] for entry in entries])))
+            collect(MAX_IN_FLIGHT)
+            return
+        with metrics.timer("inference"):
+            sentiments = score_texts([entry["text"] for entry in entries])
+        emit(entries, sentiments)
+
+    while True:
+        try:
+            item = tweet_queue.get(timeout=BATCH_TIMEOUT)
+        except queue.Empty:
+            if batch:
+                flush_batch(batch)
+                batch = []
+            continue
+        if item is stop_signal:
+            break
+        if isinstance(item, tuple):
+            # Task marker, everything queued before it has to reach the consumer first
+            if batch:
+                flush_batch(batch)
+                batch = []
+            collect()
+            data_queue.put(item)
+            continue
+        batch.extend(item)
+        while len(batch) >= BATCH_SIZE:
+            flush_batch(batch[:BATCH_SIZE])
+            batch = batch[BATCH_SIZE:]
+
+    if batch:
+        flush_batch(batch)
+    collect()
+
+class OutputWriter:
+    """
+    Writes the rows of one kind: its CSV, the matching id log and Parquet sink if any.
+    """
+    def __init__(self, kind, f, id_log=None, sink=None):
+        self.kind = kind
+        self.f = f
+        self.writer = csv.writer(f) if kind != "parked" else None
+        self.id_log = id_log
+        self.sink = sink
+
+    def write(self, rows):
+        start = time.perf_counter()
+        if self.writer is None:
+            self.f.writelines(rows)
+        else:
+            self.writer.writerows(rows)
+            if self.id_log is not None:
+                self.id_log.writelines(row[1] + "\n" for row in rows)
+            if self.sink is not None:
+                for row in rows:
+                    self.sink.write(parquet_row(self.kind, row))
+        metrics.add_time("write", time.perf_counter() - start)
+        metrics.incr(f"rows_{self.kind}", len(rows))
 
-    # Flush any remaining tweets
-    if tweet_batch:
-        flush_batch(tweet_batch)
+class ThreadedWriter(threading.Thread):
+    """
+    Runs an OutputWriter on its own thread, so every output file is written in parallel.
+    """
+    def __init__(self, output):
+        super().__init__()
+        self.output = output
+        self.queue = queue.Queue(maxsize=64)
 
-def consumer():
-    users_file = open(os.path.join(OUTPUT_DIR, "users.csv"), "w", newline="", encoding="utf-8")
-    tweets_file = open(os.path.join(OUTPUT_DIR, "tweets.csv"), "w", newline="", encoding="utf-8")
-    posted_file = open(os.path.join(OUTPUT_DIR, "posted.csv"), "w", newline="", encoding="utf-8")
-    replies_file = open(os.path.join(OUTPUT_DIR, "replies.csv"), "w", newline="", encoding="utf-8")
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is stop_signal:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            self.output.write(item)
 
-    users_writer = csv.writer(users_file)
-    tweets_writer = csv.writer(tweets_file)
-    posted_writer = csv.writer(posted_file)
-    replies_writer = csv.writer(replies_file)
+    def write(self, rows):
+        self.queue.put(rows)
 
-    users_writer.writerow([":LABEL", "userId:ID(User)", "name", "screen_name", "followers", "verified"])
-    tweets_writer.writerow([":LABEL", "tweetId:ID(Tweet)", "text", "created_at", "lang", "Type", "sentiment_label", "sentiment_expected_value"])
-    posted_writer.writerow([":START_ID(User)", ":END_ID(Tweet)", ":TYPE"])
-    replies_writer.writerow([":START_ID(Tweet)", ":END_ID(Tweet)", ":TYPE"])
+    def sync(self):
+        # Returns once every batch queued so far has been written
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        self.queue.put(stop_signal)
+        self.join()
+
+def open_writers(handles, sinks=None, threaded=False):
+    sinks = sinks or {}
+    outputs = {
+        "user": OutputWriter("user", handles["users.csv"],
+                             handles[os.path.join(STATE_DIRNAME, ID_LOGS["users.csv"])], sinks.get("users")),
+        "tweet": OutputWriter("tweet", handles["tweets.csv"],
+                              handles[os.path.join(STATE_DIRNAME, ID_LOGS["tweets.csv"])], sinks.get("tweets")),
+        "posted": OutputWriter("posted", handles["posted.csv"], sink=sinks.get("posted")),
+        "replies": OutputWriter("replies", handles["replies.csv"], sink=sinks.get("replies")),
+        "retweeted": OutputWriter("retweeted", handles["retweeted.csv"], sink=sinks.get("retweeted")),
+        "parked": OutputWriter("parked", handles[os.path.join(STATE_DIRNAME, PENDING_LOG)]),
+    }
+    if threaded:
+        outputs = {kind: ThreadedWriter(output) for kind, output in outputs.items()}
+        for writer in outputs.values():
+            writer.start()
+    return outputs
+
+def consumer(checkpoint, append, sinks=None, threaded_writers=False):
+    handles = open_outputs(append)
+    if not append:
+        checkpoint.commit(handles)
+    writers = open_writers(handles, sinks, threaded_writers)
 
     while True:
         item = data_queue.get()
         if item is stop_signal:
             break
         kind, data = item
-        if kind == "user":
-            users_writer.writerow(["User", data["uid"], data["name"], data["screen_name"], data["followers_count"], data["verified"]])
-        elif kind == "tweet":
-            tweets_writer.writerow([
-                "Tweet", data["tid"], data["text"], data["created_at"], data["lang"], data["type"],
-                data["sentiment_label"], data["sentiment_expected_value"]
-            ])
-        elif kind == "posted":
-            posted_writer.writerow([data[0], data[1], "POSTED"])
-        elif kind == "replies":
-            replies_writer.writerow([data[0], data[1], "REPLIES"])
+        if kind == "rows":
+            for row_kind, rows in data.items():
+                writers[row_kind].write(rows)
+        elif kind == "task_done":
+            if threaded_writers:
+                for writer in writers.values():
+                    writer.sync()
+            checkpoint.task_done(data, handles)
         data_queue.task_done()
 
-    users_file.close()
-    tweets_file.close()
-    posted_file.close()
-    replies_file.close()
+    if threaded_writers:
+        for writer in writers.values():
+            writer.close()
+    for f in handles.values():
+        f.close()
+
+# Raw-line prefilter: most lines are deletes or non-English and never need decoding
+LANG_EN = re.compile(rb'"lang"\s*:\s*"en"')
+DELETE_PREFIX = b'{"delete"'
+
+JSON_BACKENDS = ["simdjson", "orjson", "json"]
+json_backend = "json"
+json_loads = json.loads
+
+def set_json_backend(name="auto"):
+    """
+    Select the decoder used by parse_tweet. "auto" takes the fastest one installed.
+    simdjson decodes lazily, so only the fields parse_tweet touches are materialised;
+    orjson and json decode the whole line.
+    """
+    global json_backend, json_loads
+    for candidate in (JSON_BACKENDS if name == "auto" else [name]):
+        try:
+            if candidate == "simdjson":
+                import simdjson
+                local = threading.local()
+
+                def loads(line):
+                    # One parser per thread; a parser can only hold one document at a time
+                    parser = getattr(local, "parser", None)
+                    if parser is None:
+                        parser = local.parser = simdjson.Parser()
+                    try:
+                        return parser.parse(line)
+                    except RuntimeError:
+                        parser = local.parser = simdjson.Parser()
+                        return parser.parse(line)
+                json_loads = loads
+            elif candidate == "orjson":
+                import orjson
+                json_loads = orjson.loads
+            elif candidate == "json":
+                json_loads = json.loads
+            else:
+                raise ValueError(f"Unknown JSON backend: {candidate}")
+        except ImportError:
+            if name != "auto":
+                raise
+            continue
+        json_backend = candidate
+        return candidate
+
+def parse_status(tweet):
+    # (user_row, tweet_record, replied_tid) of one status object, None if it lacks ids or a timestamp
+    created_at_str = tweet.get("created_at")
+    if not created_at_str:
+        return None
+
+    user = tweet.get("user", {})
+    uid = user.get("id_str")
+    tid = tweet.get("id_str")
+    if not uid or not tid:
+        return None
+
+    user_row = ["User", uid, user.get("name", ""), user.get("screen_name", ""),
+                user.get("followers_count", ""), 1 if user.get("verified") else 0]
+    tweet_record = {
+        "tid": tid,
+        "text": get_full_text(tweet),
+        "created_at": created_at_str,
+        "lang": tweet.get("lang", ""),
+        "type": classify_tweet_type(tweet)
+    }
+    return user_row, tweet_record, tweet.get("in_reply_to_status_id_str")
+
+def parse_tweet(line):
+    """
+    Parse one raw JSON line into (user_row, tweet_record, replied_tid, retweet).
+    Returns None for deletes, non-English tweets and tweets missing ids.
+    With COLLAPSE_RETWEETS a retweet is parsed as its original tweet, and retweet
+    holds (retweeter user_row, retweet created_at) for the RETWEETED edge; otherwise retweet is None.
+    """
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+    if line.startswith(DELETE_PREFIX) or not LANG_EN.search(line):
+        return None
+
+    tweet = json_loads(line)
+    if "delete" in tweet:
+        return None
+    if tweet.get("lang") != "en":
+        return None
+
+    parsed = parse_status(tweet)
+    if parsed is None:
+        return None
+    if COLLAPSE_RETWEETS and "retweeted_status" in tweet:
+        original = parse_status(tweet["retweeted_status"])
+        if original is not None:
+            return (*original, (parsed[0], parsed[1]["created_at"]))
+    return (*parsed, None)
+
+def process_shard(shard_id, tasks):
+    """
+    Process-pool worker. Parses its own shard of read tasks with shard-local
+    deduplication and writes part CSVs (no headers) for merge_shards().
+    Reply edges are written as candidates, the parent check happens at merge time.
+    Counters and timings go to progress_queue after every task, so the parent's metrics
+    snapshots follow the workers. Returns the shard directory and the counters and timings
+    of the rest.
+    """
+    worker_metrics = Metrics()
+    last_sent = time.perf_counter()
+    client = sentiment_clients[shard_id] if sentiment_clients else None
+    shard_path = os.path.join(SHARD_DIR, f"shard_{shard_id}")
+    os.makedirs(shard_path, exist_ok=True)
+
+    local_users = set()
+    local_tweets = set()
+    local_posted = set()
+    local_replies = set()
+    local_retweets = set()
+    tweet_batch = []
+
+    with open(os.path.join(shard_path, "users.csv"), "w", newline="", encoding="utf-8") as users_file, \
+         open(os.path.join(shard_path, "tweets.csv"), "w", newline="", encoding="utf-8") as tweets_file, \
+         open(os.path.join(shard_path, "posted.csv"), "w", newline="", encoding="utf-8") as posted_file, \
+         open(os.path.join(shard_path, "replies.csv"), "w", newline="", encoding="utf-8") as replies_file, \
+         open(os.path.join(shard_path, "retweeted.csv"), "w", newline="", encoding="utf-8") as retweeted_file:
+
+        users_writer = csv.writer(users_file)
+        tweets_writer = csv.writer(tweets_file)
+        posted_writer = csv.writer(posted_file)
+        replies_writer = csv.writer(replies_file)
+        retweeted_writer = csv.writer(retweeted_file)
 
-# Launch producers
-producers = []
-for i in range(NUM_PRODUCERS):
-    t = threading.Thread(target=producer, args=(file_chunks[i],))
-    t.start()
-    producers.append(t)
+        def flush_batch(batch):
+            with worker_metrics.timer("inference"):
+                sentiments = score_texts([entry["text"] for entry in batch], client)
+            worker_metrics.incr("tweets_scored", len(batch))
+            worker_metrics.incr("inference_batches")
+            tweets_writer.writerows(
+                ["Tweet", entry["tid"], entry["text"], entry["created_at"], entry["lang"], entry["type"], *columns]
+                for entry, columns in zip(batch, sentiments)
+            )
+            batch.clear()
+
+        def take_progress():
+            nonlocal last_sent
+            now = time.perf_counter()
+            # Everything that isn't inference counts as parsing, including the shard-local writes
+            worker_metrics.add_time("parse", now - last_sent - worker_metrics.timings.get("inference", 0.0))
+            last_sent = now
+            return worker_metrics.drain()
+
+        for task in tasks:
+            lines = kept = 0
+            for line in iter_lines(*task):
+                lines += 1
+                try:
+                    parsed = parse_tweet(line)
+                except Exception:
+                    continue
+                if parsed is None:
+                    continue
+                user_row, tweet_record, replied_tid, retweet = parsed
+                uid, tid = user_row[1], tweet_record["tid"]
+                kept += 1
+
+                if uid not in local_users:
+                    users_writer.writerow(user_row)
+                    local_users.add(uid)
+
+                if tid not in local_tweets:
+                    tweet_batch.append(tweet_record)
+                    local_tweets.add(tid)
+                    if len(tweet_batch) >= BATCH_SIZE:
+                        flush_batch(tweet_batch)
+
+                if (uid, tid) not in local_posted:
+                    posted_writer.writerow([uid, tid, "POSTED"])
+                    local_posted.add((uid, tid))
+
+                if replied_tid and (tid, replied_tid) not in local_replies:
+                    replies_writer.writerow([tid, replied_tid, "REPLIES"])
+                    local_replies.add((tid, replied_tid))
+
+                if retweet is not None:
+                    retweeter_row, retweeted_at = retweet
+                    if retweeter_row[1] not in local_users:
+                        users_writer.writerow(retweeter_row)
+                        local_users.add(retweeter_row[1])
+                    if (retweeter_row[1], tid) not in local_retweets:
+                        retweeted_writer.writerow([retweeter_row[1], tid, retweeted_at, "RETWEETED"])
+                        local_retweets.add((retweeter_row[1], tid))
+
+            worker_metrics.incr("lines_read", lines)
+            worker_metrics.incr("tweets_kept", kept)
+            worker_metrics.incr(f"producer_{shard_id}_lines", lines)
+            if progress_queue is not None:
+                progress_queue.put(take_progress())
+
+        if tweet_batch:
+            flush_batch(tweet_batch)
+
+    return (shard_path, *take_progress())
+
+def merge_shards(shard_paths, checkpoint, append, state=None, sinks=None):
+    """
+    Merge the shard part CSVs into the final neo4j-admin import files,
+    deduplicating across shards and against the state of earlier runs.
+    REPLIES edges are kept only if both tweets exist. The checkpoint is committed
+    once at the end, so a crash during the merge rolls back the whole run.
+    """
+    state = state or {}
+    user_ids = set(state.get("users", ()))
+    tweet_ids = set(state.get("tweets", ()))
+    posted_edges = set(state.get("posted", ()))
+    reply_edges = set(state.get("replies", ()))
+    retweet_edges = set(state.get("retweeted", ()))
+
+    def read_part(shard_path, name):
+        with open(os.path.join(shard_path, name), "r", newline="", encoding="utf-8") as f:
+            yield from csv.reader(f)
+
+    handles = open_outputs(append)
+    users_writer = csv.writer(handles["users.csv"])
+    tweets_writer = csv.writer(handles["tweets.csv"])
+    posted_writer = csv.writer(handles["posted.csv"])
+    replies_writer = csv.writer(handles["replies.csv"])
+    retweeted_writer = csv.writer(handles["retweeted.csv"])
+    user_log = handles[os.path.join(STATE_DIRNAME, ID_LOGS["users.csv"])]
+    tweet_log = handles[os.path.join(STATE_DIRNAME, ID_LOGS["tweets.csv"])]
+    pending_log = handles[os.path.join(STATE_DIRNAME, PENDING_LOG)]
+
+    for shard_path in shard_paths:
+        for row in read_part(shard_path, "users.csv"):
+            if row[1] not in user_ids:
+                users_writer.writerow(row)
+                user_log.write(row[1] + "\n")
+                user_ids.add(row[1])
+                if sinks:
+                    sinks["users"].write(parquet_row("user", row))
+        for row in read_part(shard_path, "tweets.csv"):
+            if row[1] not in tweet_ids:
+                tweets_writer.writerow(row)
+                tweet_log.write(row[1] + "\n")
+                tweet_ids.add(row[1])
+                if sinks:
+                    sinks["tweets"].write(parquet_row("tweet", row))
+        for row in read_part(shard_path, "posted.csv"):
+            edge = (row[0], row[1])
+            if edge not in posted_edges:
+                posted_writer.writerow(row)
+                posted_edges.add(edge)
+                if sinks:
+                    sinks["posted"].write(edge)
+        for row in read_part(shard_path, "retweeted.csv"):
+            edge = (row[0], row[1])
+            if edge not in retweet_edges:
+                retweeted_writer.writerow(row)
+                retweet_edges.add(edge)
+                if sinks:
+                    sinks["retweeted"].write(parquet_row("retweeted", row))
+
+    # Replies last, once every shard's tweets are known. Replies parked by earlier runs get another chance,
+    # new replies whose parent is still missing are parked for the next incremental run.
+    unresolved = []
+    for child, parent in state.get("pending", ()):
+        if parent not in tweet_ids:
+            unresolved.append((child, parent))
+        elif (child, parent) not in reply_edges:
+            replies_writer.writerow([child, parent, "REPLIES"])
+            reply_edges.add((child, parent))
+            if sinks:
+                sinks["replies"].write((child, parent))
+    for shard_path in shard_paths:
+        for row in read_part(shard_path, "replies.csv"):
+            edge = (row[0], row[1])
+            if edge in reply_edges or edge[0] not in tweet_ids:
+                continue
+            if edge[1] in tweet_ids:
+                replies_writer.writerow(row)
+                if sinks:
+                    sinks["replies"].write(edge)
+            else:
+                pending_log.write(f"{edge[0]},{edge[1]}\n")
+                unresolved.append(edge)
+            reply_edges.add(edge)
+
+    checkpoint.commit(handles, list(checkpoint.pending))
+    for f in handles.values():
+        f.close()
+    checkpoint.compact_pending(unresolved)
+    shutil.rmtree(SHARD_DIR, ignore_errors=True)
+
+def run_threads(tasks, num_producers, checkpoint, append, pending=(), sinks=None, threaded_writers=False, client=None):
+    task_chunks = [tasks[i::num_producers] for i in range(num_producers)]
+
+    # Launch consumer and the inference stage feeding it
+    consumer_thread = threading.Thread(target=consumer, args=(checkpoint, append, sinks, threaded_writers))
+    consumer_thread.start()
+    inference_thread = threading.Thread(target=inference_stage, args=(client,))
+    inference_thread.start()
+
+    # Replies parked by earlier runs wait for their parent like any other (they are already in the pending log)
+    rows = RowBuffer()
+    for child, parent in pending:
+        if tweet_ids.link(child, parent) and reply_edges.add((child, parent)):
+            rows.add("replies", [child, parent, "REPLIES"])
+    rows.flush()
+
+    # Launch producers
+    producers = []
+    for i in range(num_producers):
+        t = threading.Thread(target=producer, args=(task_chunks[i], i))
+        t.start()
+        producers.append(t)
+
+    for t in producers:
+        t.join()
+
+    # Replies whose parent never showed up would point at a missing node; they stay in the pending log for later runs
+    unresolved = tweet_ids.drain_pending()
+    print(f"{len(unresolved)} replies to tweets outside the dataset left unresolved")
+
+    # Drain the inference stage first, then stop the consumer
+    tweet_queue.put(stop_signal)
+    inference_thread.join()
+    data_queue.put(stop_signal)
+    consumer_thread.join()
+    checkpoint.compact_pending(unresolved)
+
+def init_worker(backend, batch_size, score_sentiment, collapse_retweets, clients=None, progress=None,
+                model_threads=None):
+    # Settings chosen on the command line, for platforms that spawn instead of fork
+    global BATCH_SIZE, SCORE_SENTIMENT, COLLAPSE_RETWEETS, sentiment_clients, progress_queue
+    BATCH_SIZE = batch_size
+    SCORE_SENTIMENT = score_sentiment
+    COLLAPSE_RETWEETS = collapse_retweets
+    sentiment_clients = clients
+    progress_queue = progress
+    set_json_backend(backend)
+    if model_threads:
+        # The workers share the cores, a forked worker finds the parent's model already loaded
+        from roberta_sentiment import warm_up
+        warm_up(model_threads)
+
+def run_processes(tasks, num_workers, checkpoint, append, state=None, sinks=None, clients=None):
+    # Tasks come largest first, so dealing them round robin keeps the shards roughly the same size
+    task_chunks = [tasks[i::num_workers] for i in range(num_workers)]
+
+    # Without a sentiment service every worker scores its own tweets. The model is loaded here,
+    # before the pool forks, so the workers share its pages instead of loading a copy each.
+    model_threads = None
+    if SCORE_SENTIMENT and not clients:
+        from roberta_sentiment import warm_up
+        with metrics.timer("model_load"):
+            warm_up()
+        model_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    # Per-task progress of the workers, folded into metrics as it arrives
+    progress = multiprocessing.Queue()
+
+    def collect_progress():
+        while True:
+            item = progress.get()
+            if item is None:
+                break
+            metrics.merge(*item)
+
+    collector = threading.Thread(target=collect_progress, daemon=True)
+    collector.start()
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                             initargs=(json_backend, BATCH_SIZE, SCORE_SENTIMENT, COLLAPSE_RETWEETS, clients,
+                                       progress, model_threads)) as executor:
+        shard_paths = []
+        for shard_path, counters, timings in executor.map(process_shard, range(num_workers), task_chunks):
+            shard_paths.append(shard_path)
+            metrics.merge(counters, timings)
+    # The workers have exited, so everything they sent is queued ahead of this
+    progress.put(None)
+    collector.join()
+
+    with metrics.timer("merge"):
+        merge_shards(shard_paths, checkpoint, append, state, sinks)
+
+def main():
+    global BATCH_SIZE, SCORE_SENTIMENT, COLLAPSE_RETWEETS
+    parser = argparse.ArgumentParser(description="Convert raw Twitter JSON files into neo4j-admin import CSVs.")
+    parser.add_argument("--mode", choices=["threads", "processes"], default="threads",
+                        help="threads: shared producer threads, processes: one parsing process per core")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"producer threads or worker processes (default {NUM_PRODUCERS} / {NUM_WORKERS})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="tweets per sentiment inference batch")
+    parser.add_argument("--sentiment-replicas", type=int, default=0,
+                        help="score tweets in a pool of this many model processes shared by all workers (0: in process)")
+    parser.add_argument("--no-sentiment", action="store_true",
+                        help="leave the sentiment columns empty and fill them in later with backfill_sentiment.py")
+    parser.add_argument("--json-backend", choices=["auto"] + JSON_BACKENDS, default="auto",
+                        help="JSON decoder for tweet lines, auto picks the fastest one installed")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help="split uncompressed files larger than this into byte ranges shared by several workers")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only ingest files not in the manifest and append to the existing CSVs, resuming after a crash")
+    parser.add_argument("--writer-threads", action="store_true",
+                        help="give every output file its own writer thread (thread mode)")
+    parser.add_argument("--metrics", default=None,
+                        help="write periodic pipeline metrics to this file, Prometheus textfile if it ends in .prom, JSON lines otherwise")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="seconds between metrics snapshots")
+    parser.add_argument("--collapse-retweets", action="store_true",
+                        help="write each original tweet once and retweets as (User)-[:RETWEETED]->(Tweet) edges in retweeted.csv")
+    parser.add_argument("--prune-airlines", action="store_true",
+                        help="afterwards write import/pruned/ with only the reply trees that reach an airline account")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also write typed, date-partitioned Parquet datasets to import/parquet (needs pyarrow)")
+    args = parser.parse_args()
+
+    BATCH_SIZE = args.batch_size
+    SCORE_SENTIMENT = not args.no_sentiment
+    COLLAPSE_RETWEETS = args.collapse_retweets
+    set_json_backend(args.json_backend)
+    print(f"Using {json_backend} to decode tweets")
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    files = list_input_files(DATA_DIR)
+
+    manifest = load_manifest(OUTPUT_DIR) if args.incremental else None
+    append = manifest is not None
+    state = None
+    if append:
+        rollback_outputs(OUTPUT_DIR, manifest)
+        files = [path for path in files if not is_processed(manifest, path)]
+        state = load_dedup_state(OUTPUT_DIR)
+        print(f"Incremental run: {len(files)} new or changed files, {len(state['tweets'])} tweets already ingested")
+    else:
+        if args.incremental:
+            print("No manifest found, running a full ingest")
+        manifest = {"files": {}, "offsets": {}}
+
+    tasks = make_tasks(files, chunk_size=args.chunk_mb * 1024 * 1024)
+    sinks = open_sinks(["users", "tweets", "posted", "replies", "retweeted"], append) if args.parquet else None
+    checkpoint = IngestCheckpoint(OUTPUT_DIR, manifest, tasks, sinks)
+
+    if state and args.mode == "threads":
+        user_ids.update(state["users"])
+        tweet_ids.update(state["tweets"])
+        posted_edges.update(state["posted"])
+        reply_edges.update(state["replies"])
+        retweet_edges.update(state["retweeted"])
+
+    metrics.start_time = time.perf_counter()
+    metrics.gauge("data_queue_depth", data_queue.qsize)
+    metrics.gauge("tweet_queue_depth", tweet_queue.qsize)
+    metrics.gauge("dedup_lock_wait_seconds", lambda: round(sum(s.lock_wait for s in (user_ids, tweet_ids, posted_edges, reply_edges, retweet_edges)), 3))
+    metrics.gauge("pending_replies", tweet_ids.pending_count)
+    if args.metrics:
+        metrics.start_reporter(args.metrics, args.metrics_interval)
+
+    num_workers = args.workers or (NUM_WORKERS if args.mode == "processes" else NUM_PRODUCERS)
+    service = None
+    if args.sentiment_replicas and SCORE_SENTIMENT:
+        service = SentimentService(args.sentiment_replicas, max_clients=num_workers)
+
+    if args.mode == "processes":
+        clients = [service.client() for _ in range(num_workers)] if service else None
+        run_processes(tasks, num_workers, checkpoint, append, state, sinks, clients)
+        stages = {"parse": ("parse", num_workers), "inference": ("inference", num_workers), "merge": ("merge", 1)}
+    else:
+        run_threads(tasks, num_workers, checkpoint, append, state["pending"] if state else (), sinks,
+                    args.writer_threads, service.client() if service else None)
+        stages = {"parse": ("parse", num_workers), "inference": ("inference", 1),
+                  "write": ("write", len(OUTPUT_HEADERS) + 1 if args.writer_threads else 1)}
+    if service:
+        service.close()
+    checkpoint.close()
+    if sinks:
+        close_sinks(sinks)
 
-# Launch consumer
-consumer_thread = threading.Thread(target=consumer)
-consumer_thread.start()
+    metrics.stop_reporter(args.metrics)
+    print(metrics.summary(stages))
 
-for t in producers:
-    t.join()
+    if args.prune_airlines:
+        # Imported here so plain ingestion doesn't need numpy/scipy
+        from prune_airline import prune
+        prune(OUTPUT_DIR)
 
-# Signal consumer to stop and wait
-data_queue.put(stop_signal)
-consumer_thread.join()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import io
+import bz2
+import gzip
+import mmap
+
+BLOCK_SIZE = 16 * 1024 * 1024  # bytes read and split into lines at once
+CHUNK_SIZE = 512 * 1024 * 1024  # uncompressed files larger than this are split into byte ranges
+
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".zst")
+INPUT_EXTENSIONS = (".json",) + COMPRESSED_EXTENSIONS  # .json.gz etc. are covered by the compressed suffixes
+
+def list_input_files(data_dir):
+    """
+    All raw tweet dumps in data_dir, plain or compressed.
+    """
+    return sorted(
+        os.path.join(data_dir, f) for f in os.listdir(data_dir)
+        if f.endswith(INPUT_EXTENSIONS)
+    )
+
+def is_compressed(path):
+    return path.endswith(COMPRESSED_EXTENSIONS)
+
+def open_compressed(path):
+    """
+    Open a compressed dump as a binary stream that decompresses on the fly.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {path} requires the zstandard package (pip install zstandard)")
+        raw = open(path, "rb")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), buffer_size=BLOCK_SIZE)
+    raise ValueError(f"Unsupported compression: {path}")
+
+def make_tasks(files, chunk_size=CHUNK_SIZE):
+    """
+    Turn input files into (path, start, end) read tasks. Large uncompressed files
+    are split into byte ranges so several workers can share them; compressed files
+    can't be seeked into and stay one task each. Largest tasks come first.
+    """
+    tasks = []
+    for path in files:
+        size = os.path.getsize(path)
+        if is_compressed(path) or size <= chunk_size:
+            tasks.append((path, 0, None))
+            continue
+        for start in range(0, size, chunk_size):
+            tasks.append((path, start, min(start + chunk_size, size)))
+
+    def task_size(task):
+        path, start, end = task
+        return (end if end is not None else os.path.getsize(path)) - start
+
+    return sorted(tasks, key=task_size, reverse=True)
+
+def iter_lines(path, start=0, end=None):
+    """
+    Yield the raw lines (bytes, without the newline) of one read task.
+    A byte range owns every line that starts inside [start, end).
+    """
+    if is_compressed(path):
+        with open_compressed(path) as f:
+            yield from _iter_stream_lines(f)
+    else:
+        yield from _iter_mmap_lines(path, start, end)
+
+def _iter_stream_lines(f):
+    tail = b""
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            break
+        lines = (tail + block).split(b"\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+def _iter_mmap_lines(path, start, end):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        end = size if end is None else min(end, size)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # The line running into our range belongs to the previous one
+            if start > 0:
+                nl = mm.find(b"\n", start - 1)
+                if nl == -1:
+                    return
+                start = nl + 1
+
+            pos = start
+            while pos < end:
+                # Cut the block after the line containing its last byte
+                limit = min(pos + BLOCK_SIZE, end)
+                nl = mm.find(b"\n", limit - 1)
+                stop = size if nl == -1 else nl + 1
+                lines = mm[pos:stop].split(b"\n")
+                if not lines[-1]:
+                    lines.pop()
+                yield from lines
+                pos = stop